@@ -0,0 +1,511 @@
+"""----------------------------------------------------------------------------
+  Name:        featureservice.py
+  Purpose:     Helpers for reading from and writing to a feature layer
+                 in pages and batches.
+                 Functions only rely on the properties, query and
+                 edit_features members of an arcgis FeatureLayer so
+                 they can be run against a local stand-in layer.
+
+  Author:      ArcGIS for Local Government
+
+  Created:     10/16/2026
+----------------------------------------------------------------------------"""
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from time import time, sleep
+import random
+import json
+import math
+import re
+
+def id_key(idVal):
+    """Builds the key used to match an id value between the source table
+        and the target features. Whole number floats are keyed as integers."""
+    try:
+        if idVal.is_integer():
+            idVal = int(idVal)
+    except AttributeError:
+        pass
+
+    return str(idVal)
+
+# End id_key function
+
+numeric_field_types = ("Double", "Single", "Integer", "SmallInteger", "OID")
+
+def is_numeric_type(field_type):
+    """Returns True if an arcpy or feature service field type stores numbers"""
+    for numeric_type in numeric_field_types:
+        if numeric_type in field_type:
+            return True
+
+    return False
+
+# End is_numeric_type function
+
+# Numbers that can be written in a where clause
+number_literal = re.compile(r"[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$")
+
+def sql_literal(value, numeric):
+    """Formats a value for use in a where clause.
+        Returns None if a numeric field is compared to a non-numeric value,
+        including nan, inf and numbers too large for a double."""
+    if numeric:
+        literal = id_key(value).strip()
+        if not number_literal.match(literal) or math.isinf(float(literal)):
+            return None
+        return literal
+
+    return "'{}'".format(str(value).replace("'", "''"))
+
+# End sql_literal function
+
+def id_where_clauses(id_field, ids, numeric, max_bytes):
+    """Yields where clauses selecting the given ids.
+        Each clause holds as many ids as fit in max_bytes."""
+    prefix = "{} IN (".format(id_field)
+    chunk = []
+    size = len(prefix) + 1
+
+    for idVal in ids:
+        literal = sql_literal(idVal, numeric)
+        if literal is None:
+            continue
+
+        literal_size = len(literal.encode('utf-8')) + 1
+        if chunk and size + literal_size > max_bytes:
+            yield "{}{})".format(prefix, ",".join(chunk))
+            chunk = []
+            size = len(prefix) + 1
+
+        chunk.append(literal)
+        size += literal_size
+
+    if chunk:
+        yield "{}{})".format(prefix, ",".join(chunk))
+
+# End id_where_clauses function
+
+def layer_property(fl, name, default=None):
+    """Returns a property of a feature layer, or the default value if the
+        layer does not publish that property"""
+    try:
+        value = fl.properties[name]
+    except (KeyError, TypeError):
+        value = getattr(fl.properties, name, None)
+
+    if value is None:
+        return default
+
+    return value
+
+# End layer_property function
+
+def run_bounded(func, items, max_workers):
+    """Runs func over items on a pool of threads, keeping at most twice
+        max_workers requests queued at any time. Items are read on the
+        calling thread.
+        Yields (item, result) pairs in the order the requests complete."""
+    max_workers = max(1, int(max_workers))
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers) as pool:
+        pending = {}
+        for item in items:
+            pending[pool.submit(func, item)] = item
+            if len(pending) >= max_workers * 2:
+                break
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                yield item, future.result()
+
+            for item in items:
+                pending[pool.submit(func, item)] = item
+                if len(pending) >= max_workers * 2:
+                    break
+
+# End run_bounded function
+
+def _oid_pages(fl, oid_field, page_size):
+    """Splits the object ids of a layer into where clauses covering at most
+        page_size features each. Returns None if the layer does not
+        return object ids."""
+    try:
+        result = fl.query(where="1=1", return_ids_only=True)
+        oids = sorted(result['objectIds'] or [])
+    except (KeyError, TypeError):
+        return None
+
+    pages = []
+    for start in range(0, len(oids), page_size):
+        page = oids[start:start + page_size]
+        where = "{0} >= {1} AND {0} <= {2}".format(oid_field, page[0], page[-1])
+        pages.append({'where': where})
+
+    return pages
+
+# End _oid_pages function
+
+def _offset_pages(fl, oid_field, page_size):
+    """Splits a layer into result offset pages of page_size features each"""
+    count = fl.query(where="1=1", return_count_only=True)
+
+    return [{'where': "1=1",
+             'result_offset': offset,
+             'result_record_count': page_size,
+             'order_by_fields': oid_field} for offset in range(0, count, page_size)]
+
+# End _offset_pages function
+
+def fetch_id_inventory(fl, id_field, page_size=0, max_workers=4):
+    """Builds the set of id values stored in a feature layer.
+        The layer is read in pages of at most page_size features (the
+        maxRecordCount of the layer by default), split on object id ranges,
+        or on result offsets if the layer does not return object ids.
+        Up to max_workers pages are requested at the same time, and the ids
+        of each page are added to the set as it arrives."""
+    oid_field = layer_property(fl, 'objectIdField', "OBJECTID")
+    if not page_size:
+        page_size = layer_property(fl, 'maxRecordCount', 1000)
+
+    pages = _oid_pages(fl, oid_field, page_size)
+    if pages is None:
+        pages = _offset_pages(fl, oid_field, page_size)
+
+    def query_page(page):
+        return fl.query(out_fields=id_field,
+                        return_geometry=False,
+                        return_all_records=False,
+                        **page)
+
+    service_ids = set()
+    for page, fset in run_bounded(query_page, pages, max_workers):
+        service_ids.update(id_key(feature.get_value(id_field)) for feature in fset.features)
+
+    return service_ids
+
+# End fetch_id_inventory function
+
+def query_by_ids(fl, id_field, ids, numeric, out_fields, max_bytes=4000, max_workers=4):
+    """Queries the features of a layer with the given ids.
+        The ids are split into where clauses of at most max_bytes and up to
+        max_workers queries are sent at the same time.
+        Returns the features of all queries as a single list."""
+    def query_chunk(where):
+        return fl.query(where=where,
+                        out_fields=out_fields,
+                        return_geometry=False)
+
+    features = []
+    clauses = id_where_clauses(id_field, ids, numeric, max_bytes)
+    for where, fset in run_bounded(query_chunk, clauses, max_workers):
+        features.extend(fset.features)
+
+    return features
+
+# End query_by_ids function
+
+# Result lists returned by applyEdits for each edit mode
+edit_results = {'add': 'addResults', 'update': 'updateResults', 'delete': 'deleteResults'}
+edit_modes = ['add', 'update', 'delete']
+
+class EditResults(object):
+    """Summary of the edits sent to a feature layer.
+        failures holds a (mode, edit, error description) tuple for each
+        edit that was not applied."""
+
+    def __init__(self):
+        self.succeeded = 0
+        self.failures = []
+        self.requests = 0
+        self.elapsed = 0.0
+
+    @property
+    def sent(self):
+        return self.succeeded + len(self.failures)
+
+    @property
+    def rate(self):
+        """Edits sent per second"""
+        if not self.elapsed:
+            return 0.0
+        return self.sent / self.elapsed
+
+# End EditResults class
+
+def edit_size(edit):
+    """Returns the approximate size in bytes of an edit in a request"""
+    if isinstance(edit, (int, str)):
+        return len(str(edit)) + 1
+    try:
+        edit = edit.as_dict
+    except AttributeError:
+        pass
+
+    return len(json.dumps(edit, default=str)) + 1
+
+# End edit_size function
+
+def edit_batches(units, max_edits, max_bytes):
+    """Packs edit units into batches of at most max_edits edits and about
+        max_bytes of payload. A unit is an (adds, updates, deletes) tuple
+        of lists whose edits are always sent in the same request.
+        Yields each batch as a list of units as the units are read."""
+    batch = []
+    batchEdits = 0
+    batchBytes = 0
+    for unit in units:
+        unitEdits = sum(len(edits) for edits in unit)
+        unitBytes = sum(edit_size(edit) for edits in unit for edit in edits)
+        if batchEdits and (batchEdits + unitEdits > max_edits or batchBytes + unitBytes > max_bytes):
+            yield batch
+            batch = []
+            batchEdits = 0
+            batchBytes = 0
+        batch.append(unit)
+        batchEdits += unitEdits
+        batchBytes += unitBytes
+
+    if batchEdits:
+        yield batch
+
+# End edit_batches function
+
+def merge_units(units):
+    """Combines edit units into a single (adds, updates, deletes) tuple"""
+    merged = ([], [], [])
+    for unit in units:
+        for mergedList, unitList in zip(merged, unit):
+            mergedList.extend(unitList)
+
+    return merged
+
+# End merge_units function
+
+# Status codes of requests that may succeed if sent again
+transient_codes = (408, 429, 500, 502, 503, 504)
+
+# Status codes of requests that may have been applied before they failed
+unfinished_codes = (408, 502, 504)
+
+# Names of the exception classes raised by the standard library, requests
+#   and urllib3 when a request times out or loses its connection. Classes
+#   are matched by name so that requests does not have to be imported.
+timeout_errors = {"TimeoutError", "timeout", "Timeout", "ReadTimeout", "ReadTimeoutError"}
+connection_errors = {"ConnectionError", "ChunkedEncodingError", "ProtocolError", "RemoteDisconnected"}
+
+# Errors raised before the request reached the service
+refused_errors = {"ConnectionRefusedError", "ConnectTimeout", "ConnectTimeoutError"}
+
+# Status code in the text of the errors raised by arcgis
+arcgis_code = re.compile(r"Error Code:\s*(\d{3})")
+
+def request_error(ex):
+    """Describes an exception raised while sending a request as an error
+        dictionary, with the status code of the response if any.
+        The status code is read from the response of requests exceptions,
+        or from the text of arcgis exceptions."""
+    names = set(cls.__name__ for cls in type(ex).__mro__)
+    code = getattr(getattr(ex, 'response', None), 'status_code', None)
+    if code is None:
+        match = arcgis_code.search(str(ex))
+        if match:
+            code = int(match.group(1))
+
+    refused = bool(names & refused_errors)
+    return {'description': str(ex),
+            'code': code,
+            'refused': refused,
+            'timeout': not refused and bool(names & timeout_errors),
+            'connection': not refused and bool(names & connection_errors)}
+
+# End request_error function
+
+def error_code(error):
+    """Returns the status code of a request error as an integer, or None"""
+    try:
+        return int(error.get('code'))
+    except (TypeError, ValueError):
+        return None
+
+# End error_code function
+
+def is_transient(error):
+    """Returns True if a request error is worth retrying, such as a
+        timeout, a lost connection, a 5xx response or throttling.
+        Only the status code and the type of exception are considered."""
+    if error.get('timeout') or error.get('connection') or error.get('refused'):
+        return True
+
+    return error_code(error) in transient_codes
+
+# End is_transient function
+
+def may_be_applied(error):
+    """Returns True if the edits of a failed request may have been applied
+        by the service, such as when the request timed out"""
+    if error.get('timeout') or error.get('connection'):
+        return True
+
+    return error_code(error) in unfinished_codes
+
+# End may_be_applied function
+
+def send_edits(fl, batch, rollback=False):
+    """Sends a batch of edits to a feature layer in one applyEdits request.
+        Returns the response, or a response holding the error if the
+        request failed."""
+    adds, updates, deletes = batch
+    try:
+        return fl.edit_features(adds=adds or None,
+                                updates=updates or None,
+                                deletes=",".join(str(oid) for oid in deletes) or None,
+                                rollback_on_failure=rollback)
+    except Exception as ex:
+        return {'error': request_error(ex)}
+
+# End send_edits function
+
+def batch_error(response):
+    """Returns the error of a request that failed as a whole, or None"""
+    try:
+        error = response.get('error')
+    except AttributeError:
+        return {'description': "Invalid response: {}".format(response)}
+    if error and not isinstance(error, dict):
+        error = {'description': str(error)}
+
+    return error
+
+# End batch_error function
+
+def resend_risk(batch, error):
+    """Returns True if sending a failed batch again could add its features
+        twice"""
+    return bool(batch[0]) and may_be_applied(error)
+
+# End resend_risk function
+
+def send_with_retry(fl, batch, rollback=False, retries=4, delay=1.0, max_delay=60.0):
+    """Sends a batch of edits, retrying requests that fail with a transient
+        error after an exponential backoff with full jitter.
+        Batches of adds that may have been applied are not sent again."""
+    attempt = 0
+    while True:
+        response = send_edits(fl, batch, rollback)
+        error = batch_error(response)
+        if not error or attempt >= retries or not is_transient(error) or resend_risk(batch, error):
+            return response
+        sleep(random.uniform(0, min(max_delay, delay * 2 ** attempt)))
+        attempt += 1
+
+# End send_with_retry function
+
+def has_failures(response):
+    """Returns True if any edit in a response was not applied"""
+    if batch_error(response):
+        return True
+    for mode in edit_modes:
+        for editResult in response.get(edit_results[mode]) or []:
+            if not editResult.get('success', editResult.get('error') is None):
+                return True
+
+    return False
+
+# End has_failures function
+
+def send_units(fl, units, rollback=False, retries=4, delay=1.0):
+    """Sends a batch of edit units. If the request is rejected, or rolled back
+        because of a failed edit, the units are split in half and sent again
+        until the units that cannot be applied are isolated. Batches that
+        still fail with a transient error once their retries are used up
+        are reported as failed without being split, so that an outage of
+        the service does not multiply the requests.
+        Returns a list of (batch, response) pairs."""
+    batch = merge_units(units)
+    response = send_with_retry(fl, batch, rollback, retries, delay)
+    error = batch_error(response)
+
+    if len(units) > 1:
+        if (error and not is_transient(error)) or (not error and rollback and has_failures(response)):
+            middle = len(units) // 2
+            return (send_units(fl, units[:middle], rollback, retries, delay) +
+                    send_units(fl, units[middle:], rollback, retries, delay))
+
+    return [(batch, response)]
+
+# End send_units function
+
+def check_edits(batch, response, results):
+    """Records the result of every edit in a batch"""
+    batchError = batch_error(response)
+
+    for mode, edits in zip(edit_modes, batch):
+        if batchError:
+            editResults = []
+        else:
+            editResults = response.get(edit_results[mode]) or []
+        for i, edit in enumerate(edits):
+            if i < len(editResults):
+                editResult = editResults[i]
+                error = editResult.get('error')
+                if editResult.get('success', error is None):
+                    results.succeeded += 1
+                    continue
+            else:
+                error = batchError or {'description': "No result returned"}
+            if not error:
+                error = {'description': "Edit was not applied"}
+            elif not isinstance(error, dict):
+                error = {'description': str(error)}
+            results.failures.append((mode, edit, error.get('description')))
+
+# End check_edits function
+
+def collect_edits(responses, progress=None):
+    """Checks the (batch, response) pairs of an upload as they arrive.
+        progress, if given, is called with the number of edits sent so far.
+        Returns an EditResults summary."""
+    results = EditResults()
+    start = time()
+
+    for batch, response in responses:
+        results.requests += 1
+        check_edits(batch, response, results)
+        if progress:
+            progress(results.sent)
+
+    results.elapsed = time() - start
+
+    return results
+
+# End collect_edits function
+
+def upload_edits(fl, units, max_workers=4, max_edits=0, max_bytes=2000000, rollback=False,
+                 progress=None, retries=4, delay=1.0):
+    """Sends edit units to a feature layer in concurrent applyEdits requests.
+        Batches hold at most max_edits edits (the maxRecordCount of the
+        layer by default) and about max_bytes of payload, and up to
+        max_workers requests are sent at the same time.
+        Transient failures are retried up to retries times, and rejected
+        batches are split to isolate the edits that cannot be applied.
+        The result of every add, update and delete is checked.
+        progress, if given, is called with the number of edits sent so far.
+        Units are read and batched on the calling thread.
+        Returns an EditResults summary."""
+    if not max_edits:
+        max_edits = layer_property(fl, 'maxRecordCount', 1000)
+
+    def send(batch):
+        return send_units(fl, batch, rollback, retries, delay)
+
+    def responses():
+        for batch, pairs in run_bounded(send, edit_batches(units, max_edits, max_bytes), max_workers):
+            for pair in pairs:
+                yield pair
+
+    return collect_edits(responses(), progress)
+
+# End upload_edits function
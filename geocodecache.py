@@ -0,0 +1,123 @@
+"""----------------------------------------------------------------------------
+  Name:        geocodecache.py
+  Purpose:     Persistent cache of geocoding results keyed on the
+                 normalized values sent to the locator.
+                 Results are stored in a SQLite file with a namespace
+                 for each locator, and expire after a number of days.
+
+  Author:      ArcGIS for Local Government
+
+  Created:     10/16/2026
+----------------------------------------------------------------------------"""
+
+from time import time
+import sqlite3
+import re
+
+# Whitespace collapsed when addresses are normalized
+whitespace = re.compile(r"\s+")
+
+def address_key(values):
+    """Builds the cache key of the locator input values of a record.
+        Text is upper cased with runs of whitespace collapsed, whole number
+        floats become integers and empty values become empty strings."""
+    parts = []
+    for value in values:
+        if value is None:
+            value = ""
+        elif isinstance(value, float) and value.is_integer():
+            value = int(value)
+        parts.append(whitespace.sub(" ", str(value)).strip().upper())
+
+    return "|".join(parts)
+
+# End address_key function
+
+class GeocodeCache(object):
+    """Geocoding results of earlier runs for a single locator.
+        Each result is an (x, y, status, addr_type, score, match_addr)
+        tuple. Results older
+        than ttl_days are not returned and are removed when the cache is
+        closed, along with the oldest results above max_entries."""
+
+    def __init__(self, path, namespace, ttl_days=30, max_entries=500000):
+        self.namespace = namespace
+        self.ttl = ttl_days * 86400
+        self.max_entries = max_entries
+        self._conn = sqlite3.connect(path)
+
+        # Results cached without a score and matched address are dropped
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(results)")]
+        if columns and "match_addr" not in columns:
+            self._conn.execute("DROP TABLE results")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS results (
+                                  namespace TEXT, key TEXT, x REAL, y REAL,
+                                  status TEXT, addr_type TEXT, score REAL,
+                                  match_addr TEXT, created REAL,
+                                  PRIMARY KEY (namespace, key))""")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS namespaces (
+                                  namespace TEXT PRIMARY KEY, spatial_reference TEXT)""")
+        self._conn.commit()
+
+    def get_many(self, keys):
+        """Looks up the results of a set of keys.
+            Returns a dictionary of the keys found in the cache."""
+        oldest = time() - self.ttl
+        found = {}
+        keys = list(keys)
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self._conn.execute("""SELECT key, x, y, status, addr_type, score, match_addr FROM results
+                                         WHERE namespace = ? AND created >= ?
+                                         AND key IN ({})""".format(",".join("?" * len(chunk))),
+                                      [self.namespace, oldest] + chunk)
+            for row in rows:
+                found[row[0]] = tuple(row[1:])
+
+        return found
+
+    def put_many(self, results):
+        """Stores (key, (x, y, status, addr_type, score, match_addr)) pairs"""
+        now = time()
+        self._conn.executemany("""INSERT OR REPLACE INTO results
+                                  VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                               ((self.namespace, key) + tuple(result) + (now,) for key, result in results))
+        self._conn.commit()
+
+    def get_spatial_reference(self):
+        """Returns the spatial reference string of the cached points, or None"""
+        row = self._conn.execute("SELECT spatial_reference FROM namespaces WHERE namespace = ?",
+                                 [self.namespace]).fetchone()
+        return row[0] if row else None
+
+    def set_spatial_reference(self, spatial_reference):
+        """Records the spatial reference of the points returned by the locator.
+            Cached results in another spatial reference are discarded."""
+        if spatial_reference != self.get_spatial_reference():
+            self._conn.execute("DELETE FROM results WHERE namespace = ?", [self.namespace])
+        self._conn.execute("INSERT OR REPLACE INTO namespaces VALUES (?, ?)",
+                           [self.namespace, spatial_reference])
+        self._conn.commit()
+
+    def evict(self):
+        """Removes expired results, then the oldest results of all locators
+            until at most max_entries remain"""
+        self._conn.execute("DELETE FROM results WHERE created < ?", [time() - self.ttl])
+        count = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute("""DELETE FROM results WHERE rowid IN (
+                                      SELECT rowid FROM results ORDER BY created LIMIT ?)""",
+                               [count - self.max_entries])
+        self._conn.commit()
+
+    def close(self):
+        self.evict()
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# End GeocodeCache class
@@ -0,0 +1,124 @@
+"""----------------------------------------------------------------------------
+  Name:        geocoding.py
+  Purpose:     Geocode addresses in batches, on a pool of processes when
+                 there is more than one batch.
+                 Each batch is geocoded into its own scratch geodatabase
+                 so that worker processes never share a workspace.
+
+  Author:      ArcGIS for Local Government
+
+  Created:     10/16/2026
+----------------------------------------------------------------------------"""
+
+from os.path import join
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+import sys
+import arcpy
+
+# Field types created in the geocoding tables for each source field type.
+#   Date only, time only and timestamp offset fields are left out, as their
+#   values are not converted for the service.
+add_field_types = {'String': 'TEXT', 'Integer': 'LONG', 'SmallInteger': 'SHORT',
+                   'BigInteger': 'BIGINTEGER', 'Double': 'DOUBLE', 'Single': 'FLOAT',
+                   'Date': 'DATE', 'GUID': 'GUID', 'GlobalID': 'GUID', 'Blob': 'BLOB'}
+
+# Addresses sent to the locator together. fields holds a (name, type, length)
+#   tuple for each locator input, rows holds [ADDR_ID] + the input values and
+#   result_fields holds the names of the locator output fields to return.
+GeocodeBatch = namedtuple("GeocodeBatch", ["number", "fields", "rows", "locator", "addresses", "result_fields", "folder"])
+
+def geocode_table(table, locator, addresses, out_fc, result_fields):
+    """Geocodes a table of addresses identified by an ADDR_ID field.
+        Returns a dictionary of results keyed by ADDR_ID, each holding the
+        x and y of the point followed by the values of the result_fields
+        of the locator, and the spatial reference of the points."""
+    arcpy.GeocodeAddresses_geocoding(table, locator, addresses, out_fc, "STATIC")
+
+    results = {}
+    with arcpy.da.SearchCursor(out_fc, ["USER_ADDR_ID", "SHAPE@XY"] + list(result_fields)) as rows:
+        for row in rows:
+            results[row[0]] = tuple(row[1]) + tuple(row[2:])
+
+    return results, arcpy.Describe(out_fc).spatialReference
+
+# End geocode_table function
+
+def geocode_batch(batch):
+    """Geocodes a GeocodeBatch in a scratch geodatabase of its own.
+        Returns the geocode_table results and the spatial reference of the
+        points as a string, so that they can be sent back from a worker
+        process."""
+    gdbName = "geocode_{}.gdb".format(batch.number)
+    gdb = join(batch.folder, gdbName)
+    arcpy.CreateFileGDB_management(batch.folder, gdbName)
+    try:
+        table = join(gdb, "addresses")
+        arcpy.CreateTable_management(gdb, "addresses")
+        arcpy.AddFields_management(table, [["ADDR_ID", "LONG"]] +
+                                   [[name, field_type, "", length] for name, field_type, length in batch.fields])
+
+        with arcpy.da.InsertCursor(table, ["ADDR_ID"] + [name for name, field_type, length in batch.fields]) as rows:
+            for row in batch.rows:
+                rows.insertRow(row)
+
+        results, spatial_reference = geocode_table(table, batch.locator, batch.addresses, join(gdb, "results"), batch.result_fields)
+        return results, spatial_reference.exportToString()
+    finally:
+        arcpy.Delete_management(gdb)
+
+# End geocode_batch function
+
+def set_python_executable():
+    """Starts worker processes with Python rather than with the ArcGIS Pro
+        application when the script runs inside Pro"""
+    if sys.executable.lower().endswith("arcgispro.exe"):
+        multiprocessing.set_executable(join(sys.exec_prefix, "pythonw.exe"))
+
+# End set_python_executable function
+
+def geocode_records(records, fields, loc_indexes, locator, addresses, result_fields,
+                    batch_size=5000, workers=4, geocoder=geocode_batch):
+    """Geocodes the locator inputs of a dictionary of records keyed by id.
+        fields holds a (name, type, length) tuple for each record value.
+        The records are split into batches of batch_size, which are
+        geocoded by up to workers processes at the same time.
+        geocoder is called with each GeocodeBatch and may be replaced by
+        any picklable function with the same results as geocode_batch.
+        Returns the results keyed by record id and the spatial reference
+        of the points."""
+    batchFields = [fields[i] for i in loc_indexes]
+    rows = [[addrID] + [record[i] for i in loc_indexes] for addrID, record in records.items()]
+    batches = [GeocodeBatch(number, batchFields, rows[start:start + batch_size], locator, addresses,
+                            tuple(result_fields), arcpy.env.scratchFolder)
+               for number, start in enumerate(range(0, len(rows), batch_size))]
+
+    arcpy.SetProgressor("step", "Geocoding addresses", 0, len(batches), 1)
+    results = {}
+    spatial_reference = [None]
+
+    def collect(output):
+        batchResults, spatial_reference[0] = output
+        results.update(batchResults)
+        arcpy.SetProgressorLabel("Geocoded {} of {} addresses".format(len(results), len(rows)))
+        arcpy.SetProgressorPosition()
+
+    if workers > 1 and len(batches) > 1:
+        set_python_executable()
+        with ProcessPoolExecutor(min(workers, len(batches))) as pool:
+            futures = [pool.submit(geocoder, batch) for batch in batches]
+            for future in as_completed(futures):
+                collect(future.result())
+    else:
+        for batch in batches:
+            collect(geocoder(batch))
+
+    arcpy.ResetProgressor()
+
+    sr = arcpy.SpatialReference()
+    sr.loadFromString(spatial_reference[0])
+
+    return results, sr
+
+# End geocode_records function
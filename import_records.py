@@ -12,22 +12,41 @@
   Updated:     1/9/2015
 ----------------------------------------------------------------------------"""
 
-from os.path import dirname, join, exists, splitext, isfile, basename
+from os.path import dirname, join, exists, splitext, isfile, basename, getsize
 from datetime import datetime as dt
 from datetime import timedelta as td
+from datetime import date
 from time import mktime, time as t
 from calendar import timegm
 from arcgis.gis import GIS
-from arcgis.features import Feature, FeatureLayer
+from arcgis.features import FeatureLayer
 from custommessaging import Message, MsgType, printMessage, retrieveMessage, validationMessage
+from geocodecache import GeocodeCache, address_key
+from geocoding import add_field_types, geocode_records, geocode_batch
+from featureservice import id_key, is_numeric_type, layer_property, id_where_clauses, fetch_id_inventory, query_by_ids, \
+                           edit_modes, upload_edits
 import time
 import json
+import numpy as np
 import arcpy
 import csv
 import getpass
 import configparser
 import sys, traceback
-from os import rename, walk
+import re
+from functools import lru_cache
+from itertools import islice
+from os import rename, walk, remove
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import psutil
+except ImportError:
+    psutil = None
+try:
+    import resource
+except ImportError:
+    resource = None
 
 # Locator input fields
 #       World Geocode Service values are available here:
@@ -42,14 +61,59 @@ loc_zip_field     = "Postal"  # Field in all_locator_fields for Zip or postal co
 # Geocoding results fields
 status = "Status"
 addr_type = "Addr_type"
+score = "Score"
+match_addr = "Match_addr"
 
 # Accepted levels of geolocation
-addrOK = ["AddrPoint", "StreetAddr", "BldgName", "Place", "POI", "Intersection", "PointAddress", "StreetAddress", "SiteAddress","Address", "StreetAddressExt", "StreetInt"]
-match_value = ["M", "T"]
+addrOK = {"AddrPoint", "StreetAddr", "BldgName", "Place", "POI", "Intersection", "PointAddress", "StreetAddress", "SiteAddress","Address", "StreetAddressExt", "StreetInt"}
+match_value = {"M", "T"}
+
+# Geocoding results of earlier runs are reused for repeated addresses
+geocode_cache = True
+geocode_cache_name = "GeocodeCache.sqlite"  # Cache file created in the reports folder
+geocode_cache_days = 30         # Days before a cached address is geocoded again
+geocode_cache_size = 500000     # Maximum number of results kept in the cache
+
+# Addresses are geocoded in batches on a pool of processes
+geocode_batch_size = 5000       # Addresses sent to the locator in each batch
+geocode_workers = 4             # Maximum number of batches geocoded at the same time
 
 # Feature access options for AGOL hosted service
 feature_access = "Query, Create, Update, Delete, Uploads, Editing"
 
+# Feature service requests
+service_workers = 4         # Maximum number of requests sent to the target service at the same time
+inventory_page_size = 0     # Features read per page of existing ids (0 = maxRecordCount of the service)
+query_clause_bytes = 4000   # Maximum length of a where clause used to query records by id
+edit_batch_size = 0         # Maximum edits per applyEdits request (0 = maxRecordCount of the service)
+edit_batch_bytes = 2000000  # Approximate maximum payload of an applyEdits request
+apply_edits_together = False    # Send the adds, updates and deletes of a run in combined applyEdits requests
+rollback_on_failure = True      # Roll back a combined request if any of its edits fail
+edit_retries = 4            # Times a request that timed out or was throttled is sent again
+retry_delay = 1.0           # Seconds before the first retry, doubled for each attempt
+
+# Features read and converted at a time when adding records to a service
+stream_batch_size = 1000
+
+# Project features to the target spatial reference while they are read,
+#   instead of copying them to a projected feature class first
+project_on_read = True
+transformation_cache_name = "Transformations.json"  # Transformations chosen in earlier runs, in the reports folder
+
+# Keep intermediate datasets in the memory workspace instead of the scratch
+#   geodatabase, unless the source table is larger than memory_staging_limit
+memory_staging = True
+memory_staging_limit = 512  # Megabytes of source data staged in memory
+staging_value_bytes = 32    # Estimated size of each value of a source table that is not a file
+
+# CSV source tables larger than csv_chunk_limit are imported in blocks of
+#   csv_chunk_rows rows, to keep memory use bounded
+csv_chunk_rows = 50000      # Rows imported at a time (0 = import the whole table at once)
+csv_chunk_limit = 256       # Megabytes
+
+# Number of distinct date strings kept by the timestamp parser
+timestamp_cache_size = 100000
+
 # Log file header date and time formats
 date_format = "%Y-%m-%d"
 time_format = "%H:%M:%S"
@@ -58,6 +122,7 @@ time_format = "%H:%M:%S"
 prefix = "%Y-%m-%d_%H-%M-%S"
 unmatch_name = "UnMatched"
 noappend_name = "NotAppended"
+reject_name = "NotProcessed"
 errorfield = "ERRORFIELD"
 lat_field = "Y"
 long_field = "X"
@@ -92,14 +157,16 @@ e18 = Message("ir_send_edit_fail","Send edited features to service failed", MsgT
 e19 = Message("ir_add_features_failed","Add features to service failed", MsgType.ERR)
 e20 = Message("ir_extent","The Source Table has features with coordinates that are not within the allowable extent of the Target Features coordinate system.",MsgType.ERR)
 e21 = Message("ir_nocommas","Verify that Latitude and Longitude Fields are formatted without commas or spaces",MsgType.ERR)
+e22 = Message("ir_fieldtype","Field u'{}' in {} has a type that cannot be imported.", MsgType.ERR)
 
 # Warning messages
 w1 = Message("ir_notappend","*** {} records could not be appended to target features. These records have been copied to {}.", MsgType.WRN)
-w3 = Message("ir_notprocessed","The following records contain null values in required fields and were not processed: {}", MsgType.WRN)
+w3 = Message("ir_notprocessed_report","*** {} records contain null values in required fields and were not processed. These records have been copied to {}.", MsgType.WRN)
 w4 = Message("ir_prob_field","{} (problem field: {})", MsgType.WRN)
 w6 = Message("ir_nogeocode","*** {} records were not successfully geocoded.These records have been copied to {}.", MsgType.WRN)
 w7 = Message("ir_noacceptgeocode","*** {} records were not geocoded to an acceptable level of accuracy. These records have been copied to {}.", MsgType.WRN)
 w8 = Message("ir_projecterror","*** {} Attempted to project source records to match output, but unsuccessful", MsgType.WRN)
+w9 = Message("ir_edits_failed","*** {} edits were not applied to {}.", MsgType.WRN)
 
 # Informative messages
 m0 = Message("ir_login","{} Logged into portal as {}...", MsgType.INF)
@@ -118,6 +185,17 @@ m18 = Message("ir_success_append","  -- {} records successfully appended to {}."
 m19 = Message("ir_summary_field","{} records are not included in this summary because they did not contain a valid value in the summary field.", MsgType.INF)
 m20 = Message("ir_no_features","0 features to add or edit", MsgType.INF)
 m21 = Message("ir_sending","Sending edited features {} to {}", MsgType.INF)
+m22 = Message("ir_reconcile_time","  -- {} existing features compared to source records in {} seconds.", MsgType.INF)
+m23 = Message("ir_reconcile_steps","  -- Indexing source records: {} seconds. Comparing/cleaning up records: {} seconds.", MsgType.INF)
+m24 = Message("ir_features_deleted","  -- {} features deleted from {} to be added again from the source table.", MsgType.INF)
+m25 = Message("ir_timestamp_cache","  -- Date values parsed: {} read from cache, {} converted.", MsgType.INF)
+m26 = Message("ir_edit_rate","  -- {} edits applied at {} features per second.", MsgType.INF)
+m27 = Message("ir_geocode_cache","  -- {} records located from the geocode cache ({} hit rate).", MsgType.INF)
+m28 = Message("ir_geocode_distinct","  -- {} records geocoded as {} distinct addresses.", MsgType.INF)
+m29 = Message("ir_staging","  -- Intermediate data staged in {} (source data estimated at {} bytes).", MsgType.INF)
+m30 = Message("ir_peak_memory","  -- Peak memory use: {} MB.", MsgType.INF)
+m31 = Message("ir_chunked","  -- {} will be read in blocks of {} rows.", MsgType.INF)
+m32 = Message("ir_chunk","{}  Importing block {} of the source table...", MsgType.INF)
 
 # Environment settings
 # Set overwrite output option to True
@@ -137,6 +215,183 @@ def messages(msgObj, log, messageVar1=None, messageVar2=None):
 
 # End messages function
 
+# Regular expressions for the timestamp format directives that can be
+#   parsed without strptime
+timestamp_directives = {'Y': r"(?P<Y>\d{4})",
+                        'y': r"(?P<y>\d{2})",
+                        'm': r"(?P<m>\d{1,2})",
+                        'd': r"(?P<d>\d{1,2})",
+                        'H': r"(?P<H>\d{1,2})",
+                        'M': r"(?P<M>\d{1,2})",
+                        'S': r"(?P<S>\d{1,2})"}
+
+class TimestampParser(object):
+    """Converts date strings in a single timestamp format to datetimes.
+        Formats built only from the directives in timestamp_directives,
+        such as the default %m/%d/%Y %H:%M, are parsed with a precompiled
+        regular expression. Other formats use strptime.
+        Parsed values are kept in a bounded LRU cache."""
+
+    def __init__(self, timestamp, cache_size=timestamp_cache_size):
+        self.timestamp = timestamp
+        self.pattern = self._compile(timestamp)
+        self._cached_parse = lru_cache(maxsize=cache_size)(self._parse)
+
+    @staticmethod
+    def _compile(timestamp):
+        """Builds a regular expression matching the timestamp format.
+            Returns None if the format uses a directive without a fast parser."""
+        pattern = ""
+        used = set()
+        i = 0
+        while i < len(timestamp):
+            char = timestamp[i]
+            if char == "%":
+                if i + 1 >= len(timestamp):
+                    return None
+                directive = timestamp[i + 1]
+                if directive == "%":
+                    pattern += "%"
+                elif directive in timestamp_directives and directive not in used:
+                    pattern += timestamp_directives[directive]
+                    used.add(directive)
+                else:
+                    return None
+                i += 2
+            elif char.isspace():
+                pattern += r"\s+"
+                i += 1
+            else:
+                pattern += re.escape(char)
+                i += 1
+
+        if not used.intersection("Yy") or "m" not in used or "d" not in used:
+            return None
+
+        return re.compile(pattern)
+
+    def _parse(self, value):
+        if self.pattern is None:
+            return dt.strptime(value, self.timestamp)
+
+        match = self.pattern.fullmatch(value)
+        if match is None:
+            raise ValueError("time data {!r} does not match format {!r}".format(value, self.timestamp))
+
+        parts = match.groupdict()
+        if parts.get('Y'):
+            year = int(parts['Y'])
+        else:
+            # Same century rule as strptime
+            year = int(parts['y'])
+            year += 2000 if year < 69 else 1900
+
+        return dt(year,
+                  int(parts['m']),
+                  int(parts['d']),
+                  int(parts.get('H') or 0),
+                  int(parts.get('M') or 0),
+                  int(parts.get('S') or 0))
+
+    def __call__(self, value):
+        # Match strptime, which raises TypeError for values that are not strings
+        if not isinstance(value, str):
+            raise TypeError("strptime() argument 1 must be str, not {}".format(type(value).__name__))
+
+        return self._cached_parse(value)
+
+    def cache_info(self):
+        """Returns the hits and misses of the parsed value cache"""
+        info = self._cached_parse.cache_info()
+        return info.hits, info.misses
+
+# Timestamp parsers for each timestamp format used in the run
+timestamp_parsers = {}
+
+def parse_timestamp(value, timestamp):
+    """Converts a date string in the timestamp format to a datetime using a
+        shared, cached parser for that format."""
+    try:
+        parser = timestamp_parsers[timestamp]
+    except KeyError:
+        parser = timestamp_parsers.setdefault(timestamp, TimestampParser(timestamp))
+
+    return parser(value)
+
+# End parse_timestamp function
+
+def timestamp_cache_info():
+    """Returns the total cache hits and misses of the timestamp parsers"""
+    hits = 0
+    misses = 0
+    for parser in timestamp_parsers.values():
+        parserHits, parserMisses = parser.cache_info()
+        hits += parserHits
+        misses += parserMisses
+
+    return hits, misses
+
+# End timestamp_cache_info function
+
+def local_offset(hour):
+    """Returns the seconds to add to a local time within the given hour
+        since 1970-01-01 to convert it to UTC"""
+    try:
+        localTime = dt(1970,1,1,0) + td(hours=hour)
+        return int(localTime.timestamp()) - hour * 3600
+    except (OSError, OverflowError, ValueError):
+        return time.altzone
+
+# End local_offset function
+
+def dates_to_epoch(values, timestamp):
+    """Converts a column of local date values to UTC epoch milliseconds.
+        Values may be epoch milliseconds read from a feature set (truncated
+        to whole seconds), date strings in the timestamp format or datetimes.
+        The conversion runs on the whole column at once. The UTC offset is
+        looked up once per distinct hour, so dates before 1970 or outside
+        the platform time range need no per-value exception handling.
+        Empty values are returned unchanged."""
+    results = list(values)
+
+    epochRows = []
+    epochValues = []
+    dateRows = []
+    dateValues = []
+    for i, value in enumerate(values):
+        if not value:
+            continue
+        if isinstance(value, (int, float)):
+            epochRows.append(i)
+            epochValues.append(int(value))
+        elif isinstance(value, dt):
+            dateRows.append(i)
+            dateValues.append(value)
+        else:
+            dateRows.append(i)
+            dateValues.append(parse_timestamp(value, timestamp))
+
+    if not epochRows and not dateRows:
+        return results
+
+    # Naive milliseconds since 1970-01-01
+    epochArray = np.array(epochValues, dtype='int64')
+    epochArray = np.where(epochArray < 0, -(-epochArray // 1000), epochArray // 1000) * 1000
+    dateArray = np.array(dateValues, dtype='datetime64[ms]').astype('int64')
+    naive = np.concatenate([epochArray, dateArray])
+
+    # Shift from local time to UTC using the offset of each distinct hour
+    uniqueHours, inverse = np.unique(naive // 3600000, return_inverse=True)
+    offsets = np.array([local_offset(int(hour)) for hour in uniqueHours], dtype='int64')
+    utc = naive + offsets[inverse.ravel()] * 1000
+
+    for i, value in zip(epochRows + dateRows, utc.tolist()):
+        results[i] = value
+
+    return results
+
+# End dates_to_epoch function
+
 def field_vals(table,field):
     """Builds a list of all the values in a field"""
 
@@ -148,27 +403,75 @@ def field_vals(table,field):
 # End field_vals function
 
 
-def sort_records(table, writer, index, vals, inlist=True, remove=False):
-    """Sorts records into additional files based on values in a field
-        Returns the count of features moved."""
+def classify_records(table, writer, statusIndex, locIndex):
+    """Sorts geocoded records in one pass. Records that were not matched
+        and records matched below an accepted level of accuracy are written
+        to the report and deleted from the table.
+        Returns the counts of unmatched, low accuracy and accepted records."""
+    countUnmatch = 0
+    countMatch = 0
+    countAccepted = 0
     with arcpy.da.UpdateCursor(table, '*') as rows:
-        count = 0
         for row in rows:
-            if inlist and row[index] in vals:
-                count += 1
-                writer.writerow(row)
-                if remove:
-                    rows.deleteRow()
-            elif not inlist and row[index] not in vals:
-                count += 1
-                writer.writerow(row)
-                if remove:
-                    rows.deleteRow()
+            if row[statusIndex] not in match_value:
+                countUnmatch += 1
+            elif row[locIndex] not in addrOK:
+                countMatch += 1
+            else:
+                countAccepted += 1
+                continue
+            writer.writerow(row)
+            rows.deleteRow()
 
-    return count
+    return countUnmatch, countMatch, countAccepted
+
+#End classify_records function
+
+def start_report(path, header):
+    """Creates a csv report with its header row, unless records have already
+        been written to it earlier in the run"""
+    if not isfile(path) or getsize(path) == 0:
+        with open(path, "w") as reportFile:
+            csv.writer(reportFile).writerow(header)
+
+# End start_report function
+
+
+class RejectedRecords(object):
+    """Writes source records that cannot be processed to a csv report as
+        they are found, so that memory use does not grow with the number
+        of rejected records. The report is only created once a record is
+        written to it, and is added to if it already exists."""
 
-#End sort_records function
+    def __init__(self, path, fieldnames):
+        self.path = path
+        self.fieldnames = fieldnames
+        self.count = 0
+        self._file = None
+        self._writer = None
 
+    def write(self, reason, row):
+        """Writes a record and the name of the field it was rejected for"""
+        if self._writer is None:
+            start_report(self.path, [errorfield] + list(self.fieldnames))
+            self._file = open(self.path, "a", encoding='utf8')
+            self._writer = csv.writer(self._file)
+        self._writer.writerow([reason] + list(row))
+        self.count += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# End RejectedRecords class
 
 def field_test(in_fc, in_fields, out_fields, required=False):
     """Test existence of field names in datasets"""
@@ -184,6 +487,16 @@ def field_test(in_fc, in_fields, out_fields, required=False):
 
 # End field_test function
 
+def field_type_test(in_table, in_fields):
+    """Test that the fields copied to the point features have a type
+        that can be created in them"""
+
+    for field in arcpy.ListFields(in_table):
+        if field.name in in_fields and field.type not in add_field_types:
+            raise Exception(retrieveMessage(e22, field.name, in_table))
+
+# End field_type_test function
+
 def compare_locations_fs(fields, servicerow, tablerow, loc_fields):
     """Compares the values of each of a list of fields with
         the corresponding values in a dictionary.
@@ -219,6 +532,105 @@ def compare_locations_fs(fields, servicerow, tablerow, loc_fields):
 
 # End compare_locs function
 
+def canonical_value(value, field_type=""):
+    """Normalizes an attribute value so that values read from the source
+        table and from the service compare equal when they represent the
+        same data. Whole number floats become integers, other floats are
+        rounded to remove formatting noise and empty strings become None.
+        Values are then read as the type of the service field, so that the
+        number 12345 and the text "12345" match in a String field, and in
+        a numeric field."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, float):
+        if value.is_integer():
+            value = int(value)
+        else:
+            value = round(value, 9)
+    if isinstance(value, dt):
+        return value.replace(microsecond=0).isoformat()
+
+    if 'String' in field_type:
+        return str(value)
+    if isinstance(value, str) and any(numeric in field_type for numeric in ('Integer', 'Double', 'Single')):
+        number = convert_double(value)
+        if number is not None:
+            return canonical_value(number)
+
+    return value
+
+# End canonical_value function
+
+# Text that float() reads once thousands separators are removed
+number_pattern = re.compile(r"\s*[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?\s*$")
+
+def convert_double(value):
+    """Converts a value sent to a Double field. Whole numbers become
+        integers and text is read as a number without thousands
+        separators. Values that are not numbers become None."""
+    if isinstance(value, float):
+        if value.is_integer():
+            return int(value)
+        return value
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        text = value.replace(',', '')
+        if number_pattern.match(text):
+            return convert_double(float(text))
+
+    return None
+
+# End convert_double function
+
+def convert_value(value):
+    """Converts a value sent to a field that is not a Double or a Date.
+        A whole number float such as 2013.0 is sent as 2013 so that it matches
+        the value the target stores as a string or an integer."""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+
+    return value
+
+# End convert_value function
+
+def field_converters(service_fields, fieldnames):
+    """Builds the conversion of each field sent to the service once from
+        the field types of the layer.
+        Returns the function that converts the values of each field in
+        fieldnames, or None for date fields, which are converted a column
+        at a time by dates_to_epoch."""
+    field_types = dict((field['name'], field['type']) for field in service_fields)
+    converters = []
+    for fieldname in fieldnames:
+        field_type = field_types.get(fieldname, "")
+        if field_type == 'esriFieldTypeDate':
+            converters.append(None)
+        elif 'Double' in field_type:
+            converters.append(convert_double)
+        else:
+            converters.append(convert_value)
+
+    return converters
+
+# End field_converters function
+
+def convert_rows(rows, converters, timestamp):
+    """Converts rows of source values to the values sent to the service,
+        one column at a time. Returns a new list for each row."""
+    converted = [list(row) for row in rows]
+    for i, converter in enumerate(converters):
+        if converter is None:
+            column = dates_to_epoch([row[i] for row in rows], timestamp)
+        else:
+            column = [converter(row[i]) for row in rows]
+        for row, value in zip(converted, column):
+            row[i] = value
+
+    return converted
+
+# End convert_rows function
+
 def cast_id(idVal, field_type):
     """If possible, re-cast a value to a specific field type
         Otherwise, cast it as a string."""
@@ -234,6 +646,35 @@ def cast_id(idVal, field_type):
 
 #End cast_id function
 
+def index_rows(table, fields, id_index):
+    """Reads a table once and builds a dictionary of its rows keyed on id.
+        Each entry is a list of [objectid, row] pairs."""
+    row_index = {}
+    with arcpy.da.SearchCursor(table, fields + ["OID@"]) as rows:
+        for row in rows:
+            row = list(row)
+            oid = row.pop()
+            row_index.setdefault(id_key(row[id_index]), []).append([oid, row])
+
+    return row_index
+
+# End index_rows function
+
+def delete_rows(table, oids):
+    """Deletes the rows with the given object ids in a single cursor pass.
+        Returns the count of rows deleted."""
+    count = 0
+    if oids:
+        with arcpy.da.UpdateCursor(table, ["OID@"]) as rows:
+            for row in rows:
+                if row[0] in oids:
+                    rows.deleteRow()
+                    count += 1
+
+    return count
+
+# End delete_rows function
+
 def processFieldMap(fieldmapstring):
     fmsObj = {}
     fieldmapstring = fieldmapstring.replace(")' '","|").replace(" (","*").replace(")","").replace("'","")
@@ -252,55 +693,84 @@ def processFieldMap(fieldmapstring):
         fmsObj.update(fmObj)
     return fmsObj
 
-def _prep_source_table(new_features, matchingfields, id_field, dt_field, loc_fields):
+def _record_date(value, dt_field, timestamp):
+    """Returns a date value from the source table as a datetime"""
+    if isinstance(value, dt):
+        return value
+    try:
+        return parse_timestamp(value, timestamp)
+    except (TypeError, ValueError):
+        raise Exception(retrieveMessage(e15, dt_field, timestamp))
+
+def _source_id(idVal, split_decimals):
+    """Returns the id of a source record as a string"""
+    idVal = str(idVal)
+    if split_decimals:
+        idVal = idVal.split(".")[0]
+    return idVal
+
+def _keep_latest(latest, idVal, number, dtVal, dt_field, timestamp):
+    """Records a report of an id in latest, a dictionary of the most recent
+        report of each id held as [number, date value, parsed date] lists.
+        Dates are only parsed for ids that appear more than once, and the
+        first of reports with the same date is kept.
+        Returns the number of the report that is not kept, or None."""
+    try:
+        kept = latest[idVal]
+    except KeyError:
+        latest[idVal] = [number, dtVal, None]
+        return None
+
+    if kept[2] is None:
+        kept[2] = _record_date(kept[1], dt_field, timestamp)
+    row_date = _record_date(dtVal, dt_field, timestamp)
+    if row_date > kept[2]:
+        latest[idVal] = [number, dtVal, row_date]
+        return kept[0]
+
+    return number
+
+def _prep_source_table(new_features, matchingfields, id_field, dt_field, timestamp, rejects, workspace="memory"):
     # Create temporary table of the new data
     del_count = 0
-    tempTable = arcpy.CopyRows_management(new_features, join('in_memory','tempTableLE'))
+    tempTable = arcpy.CopyRows_management(new_features, join(workspace,'tempTableLE'))
     tableidFieldType = arcpy.ListFields(tempTable, id_field)[0].type
 
     # Field indices for identifying most recent record
     id_index = matchingfields.index(id_field)
     dt_index = matchingfields.index(dt_field)
 
-    # Record and delete rows with null values that cannot be processed
-    where_null = """{0} IS NULL OR {1} IS NULL""".format(id_field, dt_field)
-    null_records = ""
-    with arcpy.da.UpdateCursor(tempTable, [id_field, dt_field], where_null) as null_rows:
-        if null_rows:
-            for null_row in null_rows:
-                null_records = "{}{}\n".format(null_records, null_row)
-                null_rows.deleteRow()
-                del_count += 1
-
-    # Delete all but the most recent report if the table contains duplicates
-    all_ids = [str(csvrow[id_index]) for csvrow in arcpy.da.SearchCursor(tempTable, matchingfields)]
-
     # Clean decimal values out of current IDs if they exist. Use case:
     # User may assume that ID field is an integer but in reality Excel has formatted their field as
     # an double or float without user recognizing it
+    split_decimals = tableidFieldType in ["Double", "Single"]
 
-    if tableidFieldType in ["Double", "Single"]:
-        all_ids = [idrec.split(".")[0] for idrec in all_ids]
+    # Report rows with null values that cannot be processed and find the
+    #   most recent report for each id in a single pass
+    del_oids = set()
+    latest = {}
+    with arcpy.da.SearchCursor(tempTable, ["OID@"] + matchingfields) as rows:
+        for row in rows:
+            oid = row[0]
+            idVal = row[id_index + 1]
+            dtVal = row[dt_index + 1]
+            if idVal is None or dtVal is None:
+                rejects.write(id_field if idVal is None else dt_field, row[1:])
+                del_oids.add(oid)
+                continue
 
-    dup_ids = [id for id in list(set(all_ids)) if all_ids.count(id) > 1]
-    #fieldsToReview = [dt_field] + loc_Fields
-    if dup_ids:
-        for dup_id in dup_ids:
-            if tableidFieldType in ["Double", "Single", "Integer", "SmallInteger"]:
-                where_dup = """{} = {}""".format(id_field, dup_id)
-            else:
-                where_dup = """{} = '{}'""".format(id_field, dup_id)
-            with arcpy.da.UpdateCursor(tempTable, [dt_field] + loc_fields, where_dup, sql_clause=[None,"ORDER BY {} DESC".format(dt_field)]) as dup_rows:
-                count = 0
-                for dup_row in dup_rows:
-                    if count > 0:
-                        dup_rows.deleteRow()
-                        del_count += 1
-                    count += 1
-    
-    return tempTable, tableidFieldType, dt_index, all_ids, null_records, del_count
+            # Keep the most recent report for the id
+            older = _keep_latest(latest, _source_id(idVal, split_decimals), oid, dtVal, dt_field, timestamp)
+            if older is not None:
+                del_oids.add(older)
+
+    # Delete the null rows and all but the most recent report of each id
+    del_count += delete_rows(tempTable, del_oids)
+    all_ids = list(latest)
+
+    return tempTable, dt_index, all_ids, del_count
 
-def remove_dups_fs(new_features, cur_features, fields, id_field, dt_field, loc_fields, timestamp, log):
+def remove_dups_fs(new_features, cur_features, fields, id_field, dt_field, loc_fields, timestamp, rejects, log, changeset=None, workspace="memory", service_ids=None, report=None):
     """Compares records with matching ids and determines which is more recent.
         If the new record is older than the existing record, no updates
         If the new record has the same or a more recent date, the locations
@@ -308,253 +778,223 @@ def remove_dups_fs(new_features, cur_features, fields, id_field, dt_field, loc_f
 
             If the location has changed the existing record is deleted
             If the locations are the same the existing record attributes
-                are updated"""
+                are updated
+
+        If a changeset is provided, the deletes and updates are added to it
+            instead of being sent to the service
+
+        The service is queried on a background thread while the source
+            table is prepared and indexed
+
+        The source table is copied to workspace before it is cleaned up
+
+        If service_ids is provided, it is used as the set of ids already in
+            the service instead of querying them
+
+        Updates that cannot be applied are appended to the report"""
     update_count = 0
-    tempTable, tableidFieldType, dt_index, all_ids, null_records, del_count = _prep_source_table(new_features, fields, id_field, dt_field, loc_fields)
+
+    # Look for reports that already exist in the service while the source
+    #   table is prepared
+    with ThreadPoolExecutor(1) as background:
+        if service_ids is None:
+            inventory = background.submit(fetch_id_inventory, cur_features, id_field,
+                                          inventory_page_size, service_workers)
+
+        tempTable, dt_index, all_ids, del_count = _prep_source_table(new_features, fields, id_field, dt_field, timestamp, rejects, workspace)
+
+        if service_ids is None:
+            service_ids = inventory.result()
+
     # service field types
     service_field_types = {}
     for field in cur_features.properties.fields:
         service_field_types[field['name']] = field['type']
-    
-    # Look for reports that already exist in the service
-    service_ids = cur_features.query(where="1=1",out_fields=id_field, returnGeometry=False)
-    
-    # Use id values common to service and new data to build a where clause
-    common_ids = list(set(all_ids).intersection([str(service_id.get_value(id_field)) for service_id in service_ids]))
-    if common_ids:
-        if not len(list(set(all_ids))) == 1:
-            where_clause = """{0} IN {1}""".format(id_field, tuple(common_ids))
-        else:
-            where_clause = """{0} = {1}""".format(id_field, tuple(common_ids[0]))
 
-        curFeaturesFS = cur_features.query(where=where_clause, out_fields=",".join(fields), returnGeometry=False)
+    # Use id values common to service and new data to query the existing records
+    common_ids = list(service_ids.intersection(all_ids))
+    if common_ids:
+        # Query the common records in chunks of ids that fit in a where clause
+        oid_field = layer_property(cur_features, 'objectIdField', "OBJECTID")
 
         updateFeatures = []
 
-        for servicerow in curFeaturesFS.features:
+        # Object ids of service features to delete and re-add from the table
+        service_deletes = []
+
+        # Index and convert the source rows while the service is queried
+        timeStart = t()
+        with ThreadPoolExecutor(1) as background:
+            commonQuery = background.submit(query_by_ids,
+                                            cur_features,
+                                            id_field,
+                                            common_ids,
+                                            is_numeric_type(service_field_types[id_field]),
+                                            ",".join(fields + [oid_field]),
+                                            query_clause_bytes,
+                                            service_workers)
+
+            # Read the source table once and index its rows by id
+            table_index = index_rows(tempTable, fields, fields.index(id_field))
+
+            # Convert the matching records to the values sent to the service,
+            #   with dates as UTC timestamps
+            common_rows = [entry for key in common_ids for entry in table_index.get(key, [])]
+            converters = field_converters(cur_features.properties.fields, fields)
+            fieldTypes = [service_field_types.get(fieldname, "") for fieldname in fields]
+            for entry, values in zip(common_rows, convert_rows([entry[1] for entry in common_rows], converters, timestamp)):
+                entry.append(values)
+
+            curFeaturesFS = commonQuery.result()
+        timeIndexed = t()
+
+        # Object ids of source rows to remove once all features are compared
+        table_deletes = set()
+
+        for servicerow in curFeaturesFS:
             # Get the id value for the row
             idVal = cast_id(servicerow.get_value(id_field), service_field_types[id_field])
             # Grab the attributes values associated with that id
-            if tableidFieldType in ["Double", "Single", "Integer", "SmallInteger"]:
-                where_service_dup = """{} = {}""".format(id_field, idVal)
-            else:
-                where_service_dup = """{} = '{}'""".format(id_field, idVal)
-            with arcpy.da.UpdateCursor(tempTable, fields, where_service_dup) as csvdups:
-                for csvdup in csvdups:
+            csvdups = table_index.get(id_key(idVal), [])
+            for csvdup_entry in list(csvdups):
+                csvoid, csvdup, sendValues = csvdup_entry
                 # Test if new record is more recent (date_status = True)
-                    try:
-                        #Bring in time stamp from service in system time
-                        if 'Date' in service_field_types[dt_field]:
-                            serviceTime = int(servicerow.get_value(dt_field)/1000)
-                            try:
-                                date2 = dt.fromtimestamp(serviceTime)
-                            except (OverflowError, OSError):
-                                date2 = dt(1970,1,1,0) + td(seconds= serviceTime - time.altzone)
-                        else:
-                            date2 = dt.strptime(servicerow.get_value(dt_field),timestamp)
+                try:
+                    #Bring in time stamp from service in system time
+                    if service_field_types[dt_field] == 'esriFieldTypeDate':
+                        serviceTime = int(servicerow.get_value(dt_field)/1000)
+                        try:
+                            date2 = dt.fromtimestamp(serviceTime)
+                        except (OverflowError, OSError):
+                            date2 = dt(1970,1,1,0) + td(seconds= serviceTime - time.altzone)
+                    else:
+                        date2 = parse_timestamp(servicerow.get_value(dt_field),timestamp)
 
-                        #Check to see if spreadsheet date is already a datetime, if not convert to datetime
-                        if isinstance(csvdup[dt_index], dt):
-                            date1 = csvdup[dt_index]
-                        else:
-                            date1 = dt.strptime(csvdup[dt_index],timestamp)
+                    #Check to see if spreadsheet date is already a datetime, if not convert to datetime
+                    if isinstance(csvdup[dt_index], dt):
+                        date1 = csvdup[dt_index]
+                    else:
+                        date1 = parse_timestamp(csvdup[dt_index],timestamp)
 
-                        date1 = date1.replace(microsecond = 0)
-                        date2 = date2.replace(microsecond = 0)
-                    except TypeError:
-                        raise Exception(retrieveMessage(e15,dt_field, timestamp))
+                    date1 = date1.replace(microsecond = 0)
+                    date2 = date2.replace(microsecond = 0)
+                except TypeError:
+                    raise Exception(retrieveMessage(e15,dt_field, timestamp))
 
-                    # If new record older, delete the record from the table
-                    if date1 < date2:
-                        csvdups.deleteRow()
-                        del_count += 1
+                # If new record older, delete the record from the table
+                if date1 < date2:
+                    csvdups.remove(csvdup_entry)
+                    table_deletes.add(csvoid)
+                    del_count += 1
 
-                    # Otherwise, compare location values
+                # Otherwise, compare location values
+                else:
+                    loc_status = compare_locations_fs(fields, servicerow, csvdup, loc_fields)
+                    # If the location has changed
+                    if loc_status:
+                        # Delete the row from the service
+                        service_deletes.append((id_key(idVal), servicerow.get_value(oid_field)))
                     else:
-                        loc_status = compare_locations_fs(fields, servicerow, csvdup, loc_fields)
-                        # If the location has changed
-                        if loc_status:
-                            # Delete the row from the service
-                            if tableidFieldType in ["Double", "Single", "Integer", "SmallInteger"]:
-                                del_where = """{} = {}""".format(id_field, idVal)
-                            else:
-                                del_where = """{} = '{}'""".format(id_field, idVal)
-                            cur_features.delete_features(where=del_where)
-                        else:
-                            # Same location, try to update the service attributes
-                            try:
-                                field_info = []
-                                for i in range(0, len(fields)):
-                                    fvals = {}
-                                    fvals['FieldName'] = fields[i]
-
-                                    # Make sure doubles get processed as doubles
-                                    if 'Double' in service_field_types[fields[i]]:
-                                        try:
-                                            if int(csvdup[i]) == csvdup[i]:
-                                                fvals['ValueToSet'] = int(csvdup[i])
-                                            else:
-                                                fvals['ValueToSet'] = float(str(csvdup[i]).replace(',',''))
-                                        except (TypeError, ValueError):
-                                            try:
-                                                fvals['ValueToSet'] = float(str(csvdup[i]).replace(',',''))
-                                            except:
-                                                fvals['ValueToSet'] = None
-
-                                    elif 'Date' in service_field_types[fields[i]]:
-                                        if csvdup[i]:
-                                            try:
-                                                #DateString -> Datetime -> UNIX timestamp integer
-                                                fvals['ValueToSet'] = int(dt.strptime(csvdup[i],timestamp).timestamp()*1000)
-                                            except TypeError:
-                                                #Create a unix timestamp integer in UTC time to send to service
-                                                try:
-                                                    fvals['ValueToSet'] = int(csvdup[i].timestamp()*1000)
-                                                except (OSError, OverflowError):
-                                                    fvals['ValueToSet'] = int(((dt(1970,1,1,0) - csvdup[i]).total_seconds() - time.altzone) * -1000)
-                                            except (OSError, OverflowError):
-                                                fvals['ValueToSet'] = int(((dt(1970,1,1,0) - dt.strptime(csvdup[i],timestamp)).total_seconds() - time.altzone) * -1000)
-
-                                        else:
-                                                fvals['ValueToSet'] = csvdup[i]
-                                    else:
-                                        # If a source table value is a whole number float such as 2013.0 and the target stores
-                                        # that number as 2013 either as a string or a integer. Convert it to an integer here
-                                        # to prevent a mismatch between the source and the target in the future
-                                        try:
-                                            if int(csvdup[i]) == csvdup[i]:
-                                                fvals['ValueToSet'] = int(csvdup[i])
-                                            else:
-                                                fvals['ValueToSet'] = csvdup[i]
-                                        except (TypeError, ValueError):
-                                            fvals['ValueToSet'] = csvdup[i]
-
-                                    field_info.append(fvals)
-                                #Check to see if any attributes are different between target service and source table
-                                updateNeeded = False
-                                for fld in field_info:
-                                    serv_str = str(servicerow.get_value(fld["FieldName"]))
-                                    #If the service value is a whole number with ".0" at the end ignore ".0"                                      
-                                    try:
-                                        if servicerow.get_value(fld["FieldName"]).is_integer():
-                                            serv_str = str(int(servicerow.get_value(fld["FieldName"])))
-                                    except AttributeError:
-                                        pass
-                                    if serv_str != str(fld['ValueToSet']):
-                                        updateNeeded = True
-                                
-                                #At least one attribute change detected so send new attributes to service
-                                if updateNeeded:
-                                    for fld in field_info:
-                                        servicerow.set_value(fld["FieldName"],fld['ValueToSet'])
-                                    updateFeatures.append(servicerow)
-                                    update_count += 1
-                                # Remove the record from the table
-                                csvdups.deleteRow()
-
-                            # If there is a field type mismatch between the service
-                            #   and the table, delete the row in the
-                            #   service. The table record will be
-                            #   re-geocoded and placed in the un-appended report for
-                            #   further attention.
-                            except RuntimeError:
-                                del_where = """{} = {}""".format(id_field, idVal)
-                                cur_features.delete_features(where=del_where)
-        # Sends updated features to service in batches of 100
-        editFeatures(updateFeatures,cur_features,"update", log)
+                        # Same location, try to update the service attributes
+                        try:
+                            #Check to see if any attributes are different between target service and source table
+                            table_values = [canonical_value(value, field_type) for value, field_type in zip(sendValues, fieldTypes)]
+                            service_values = [canonical_value(servicerow.get_value(fld), field_type) for fld, field_type in zip(fields, fieldTypes)]
+
+                            #At least one attribute change detected so send new attributes to service
+                            changed = [i for i in range(0, len(fields)) if table_values[i] != service_values[i]]
+                            if changed:
+                                for i in changed:
+                                    servicerow.set_value(fields[i], sendValues[i])
+                                updateFeatures.append(servicerow)
+                                update_count += 1
+                            # Remove the record from the table
+                            csvdups.remove(csvdup_entry)
+                            table_deletes.add(csvoid)
+
+                        # If there is a field type mismatch between the service
+                        #   and the table, delete the row in the
+                        #   service. The table record will be
+                        #   re-geocoded and placed in the un-appended report for
+                        #   further attention.
+                        except RuntimeError:
+                            service_deletes.append((id_key(idVal), servicerow.get_value(oid_field)))
+        timeCompared = t()
+
+        # Remove the older and updated records from the table in one pass
+        delete_rows(tempTable, table_deletes)
+        timeCleaned = t()
+
+        messages(m22, log, len(curFeaturesFS), "{:.2f}".format(timeCleaned - timeStart))
+        messages(m23, log, "{:.2f}".format(timeIndexed - timeStart),
+                 "{:.2f}/{:.2f}".format(timeCompared - timeIndexed, timeCleaned - timeCompared))
+
+        if service_deletes:
+            messages(m24, log, len(service_deletes), cur_features.url)
+
+        if changeset is not None:
+            # Hold the edits to send with the new features
+            changeset['deletes'].extend(service_deletes)
+            changeset['updates'].extend(updateFeatures)
+        else:
+            # Sends deleted and updated features to service in batches of 100
+            editResults = []
+            if service_deletes:
+                editResults.append(editFeatures([oid for key, oid in service_deletes], cur_features, "delete", log))
+            editResults.append(editFeatures(updateFeatures,cur_features,"update", log))
+            if report is not None:
+                for results in editResults:
+                    write_failed_edits(results, report, fields, log)
 
     ##                    break
 
     # Return the records to geocode
-    return tempTable, null_records, update_count, del_count
+    return tempTable, update_count, del_count
 
-def compare_dates_fc(fields, dt_field, row, id_vals, timestamp):
-    """Compares date values in a row and a dictionary.
+def compare_dates_fc(row_date, dict_date):
+    """Compares the pre-parsed date of a row with the date stored for
+        the same id.
         Returns True if the row date is the more recent value."""
 
-    status = False
-
-    dt_index = fields.index(dt_field)
-
-    # Create datetime items from string dates if necessary
-    try:
-        row_date = dt.strptime(row[dt_index],timestamp)
-    except TypeError:
-        # Date values OK
-        if isinstance(row[dt_index], dt):
-            row_date = row[dt_index]
-        # Fail if non-date value
-        else:
-            raise Exception(retrieveMessage(e15,dt_field, timestamp))
-
-    try:
-        dict_date = dt.strptime(id_vals[dt_field],timestamp)
-    except TypeError:
-        if isinstance(id_vals[dt_field], dt):
-            dict_date = id_vals[dt_field]
-        else:
-            raise Exception(retrieveMessage(e15,dt_field, timestamp))
-
-    row_date = row_date.replace(microsecond= 0)
-    dict_date = dict_date.replace(microsecond= 0)
-
-    if dict_date < row_date:
-        status = True
-    else:
-        status = False
-
-    return status
+    return dict_date < row_date
 
 # End compare_dates_fc function
 
 
-def compare_locations_fc(fields, fcrow, id_vals, loc_fields):
-    """Compares the values of each of a list of fields with
-        the corresponding values in a dictionary.
+def compare_locations_fc(fcrow, dict_row, loc_indexes):
+    """Compares the values at each of a list of field positions in a
+        row and the values stored for the same id.
         Compares values accross field types.
         Returns True if the values are different"""
 
     status = False
 
-    for loc_field in loc_fields:
-
-        if loc_field in fields:
-            loc_index = fields.index(loc_field)
+    for loc_index in loc_indexes:
+        dict_val = dict_row[loc_index]
+        fc_val = fcrow[loc_index]
 
-            try:
-                if id_vals[loc_field].is_integer():
-                        id_vals[loc_field] = int(id_vals[loc_field])
-            except AttributeError:
-                pass
+        try:
+            if dict_val.is_integer():
+                dict_val = int(dict_val)
+        except AttributeError:
+            pass
 
-            try:
-                if fcrow[loc_index].is_integer():
-                    fcrow[loc_index] = int(fcrow[loc_index])
-            except AttributeError:
-                pass
+        try:
+            if fc_val.is_integer():
+                fc_val = int(fc_val)
+        except AttributeError:
+            pass
 
-            if not str(id_vals[loc_field]).upper() == str(fcrow[loc_index]).upper():
-                status = True
-                break
+        if not str(dict_val).upper() == str(fc_val).upper():
+            status = True
+            break
 
     return status
 
 # End compare_locs_fc function
 
 
-def update_dictionary_fc(fields, values, dictionary):
-    """Update values in a dictionary using a table row"""
-    for i in range(0, len(fields)):
-        # Update the dictionary with the more recent values
-        dictionary[fields[i]] = values[i]
-        i += 1
-
-    return dictionary
-
-# End update_dictionary_fc function
-
-
-def remove_dups_fc(new_features, cur_features, fields, id_field, dt_field, loc_fields, timestamp):
+def remove_dups_fc(new_features, cur_features, fields, id_field, dt_field, loc_fields, timestamp, rejects, workspace="memory"):
     """Compares records with matching ids and determines which is more recent.
         If the new record is older than the existing record, no updates
         If the new record has the same or a more recent date, the locations
@@ -563,22 +1003,19 @@ def remove_dups_fc(new_features, cur_features, fields, id_field, dt_field, loc_f
             If the locations are the same the existing record attributes
                 are updated"""
     # Create temporary table of the new data
-    tempTable = arcpy.CopyRows_management(new_features, join('in_memory','tempTableLE'))
-    
-    tableidFieldType = arcpy.ListFields(tempTable, id_field)[0].type
+    tempTable = arcpy.CopyRows_management(new_features, join(workspace,'tempTableLE'))
 
-    # Dictionary of attributes from most recent report
+    # Most recent report of each id, stored as a (row values, report date)
+    #   tuple. Row values are in the order of fields.
     att_dict = {}
 
     # Field indices for identifying most recent record
     id_index = fields.index(id_field)
     dt_index = fields.index(dt_field)
+    loc_indexes = [fields.index(loc_field) for loc_field in loc_fields if loc_field in fields]
 
     field_type = arcpy.ListFields(cur_features, id_field)[0].type
 
-    # Records with null values that cannot be processed
-    null_records = ""
-
     # Build dictionary of most recent occurance of each incident in the spreadsheet
     with arcpy.da.UpdateCursor(tempTable, fields) as csvrows:
 
@@ -590,7 +1027,7 @@ def remove_dups_fc(new_features, cur_features, fields, id_field, dt_field, loc_f
             # Process only rows containing all required values
             if idVal is None or dtVal is None:
                 # If required values are missing, write the row out
-                null_records = "{}{}\n".format(null_records, csvrow)
+                rejects.write(id_field if idVal is None else dt_field, csvrow)
 
             else:
                 try:
@@ -600,45 +1037,37 @@ def remove_dups_fc(new_features, cur_features, fields, id_field, dt_field, loc_f
                     pass
 
                 idVal = cast_id(idVal, field_type)
-                
+                row_date = _record_date(dtVal, dt_field, timestamp).replace(microsecond=0)
+
                 try:
                     # Try to find the id in the dictionary
-                    id_vals = att_dict[idVal]
+                    dict_row, dict_date = att_dict[idVal]
                     
                     # Test if the new row is more recent
-                    status = compare_dates_fc(fields, dt_field, csvrow, id_vals, timestamp)
+                    status = compare_dates_fc(row_date, dict_date)
 
                     # If it is, update the values in the dictionary
                     if status:
-                        id_vals = update_dictionary_fc(fields, csvrow, id_vals)
+                        att_dict[idVal] = (tuple(csvrow), row_date)
                     else:
                         #If its not more recent record delete it from the source table
                         #This means the source table has multiple records with the same ID
                         csvrows.deleteRow()
 
                 except KeyError:
-                    # If the id isn't in the dictionary, build a dictionary
-                    id_vals = {}
-                    id_vals = update_dictionary_fc(fields, csvrow, id_vals)
-                    att_dict[idVal] = id_vals 
+                    # If the id isn't in the dictionary, add it
+                    att_dict[idVal] = (tuple(csvrow), row_date)
 
     # Compare the existing features to the dictionary to find updated incidents
 
     update_count = 0
 
-    dateFields = [field.name for field in arcpy.ListFields(cur_features, field_type="Date") if field.name in fields]
-
     if len(att_dict) > 0:
 
-        # Use the dictionary keys to build a where clause
-        if not len(att_dict) == 1:
-            vals = tuple(att_dict.keys())
-            where_clause = """{0} IN {1}""".format(id_field, vals)
-        else:
-            if tableidFieldType in ["Double", "Single", "Integer", "SmallInteger"]:
-                where_clause = """{} = {}""".format(id_field, att_dict.keys()[0])
-            else:
-                where_clause = """{} = '{}'""".format(id_field, att_dict.keys()[0])
+        # Use the dictionary keys to build where clauses that fit in
+        #   the query length limit
+        where_clauses = list(id_where_clauses(id_field, list(att_dict.keys()),
+                                              is_numeric_type(field_type), query_clause_bytes))
 
         desc = arcpy.Describe(cur_features)
         if desc.isVersioned:
@@ -646,62 +1075,56 @@ def remove_dups_fc(new_features, cur_features, fields, id_field, dt_field, loc_f
             editor.startEditing()
             editor.startOperation()
 
-        with arcpy.da.UpdateCursor(cur_features, fields, where_clause) as fcrows:
-            for fcrow in fcrows:
-
-                # Get the id value for the row
-                idVal = fcrow[id_index]
+        for where_clause in where_clauses:
+            with arcpy.da.UpdateCursor(cur_features, fields, where_clause) as fcrows:
+                for fcrow in fcrows:
 
-                idVal = cast_id(idVal, field_type)
+                    # Get the id value for the row
+                    idVal = fcrow[id_index]
 
-                try:
-                    # Grab the attributes values associated with that id from source table
-                    id_vals = att_dict[idVal]
+                    idVal = cast_id(idVal, field_type)
 
-                    # Test if fc record is more recent (date_status = True)
                     try:
-                        date_status = compare_dates_fc(fields,dt_field, fcrow, id_vals, timestamp)
+                        # Grab the attributes values associated with that id from source table
+                        dict_row, dict_date = att_dict[idVal]
 
-                    except TypeError:
-                        raise Exception(retrieveMessage(e15,dt_field, timestamp))
+                        # Test if fc record is more recent (date_status = True)
+                        fc_date = _record_date(fcrow[dt_index], dt_field, timestamp).replace(microsecond=0)
+                        date_status = compare_dates_fc(fc_date, dict_date)
 
-                    # If fc more recent, update the values in the dictionary
-                    if date_status:
-                        id_vals = update_dictionary_fc(fields, fcrow, id_vals)
+                        # If fc more recent, update the values in the dictionary
+                        if date_status:
+                            att_dict[idVal] = (tuple(fcrow), fc_date)
 
-                    else:
-                        loc_status = compare_locations_fc(fields, fcrow, id_vals, loc_fields)
+                        else:
+                            loc_status = compare_locations_fc(fcrow, dict_row, loc_indexes)
 
-                        # If the location has changed
-                        if loc_status:
+                            # If the location has changed
+                            if loc_status:
 
-                            # Delete the row from the feature class
-                            fcrows.deleteRow()
+                                # Delete the row from the feature class
+                                fcrows.deleteRow()
 
-                        else:
-                            # Same location, try to update the feature attributes
-                            try:
-                                i = 0
-                                while i <= len(fields) - 1:
-                                    fcrow[i] = id_vals[fields[i]]
-                                    i += 1
-                                fcrows.updateRow(fcrow)
+                            else:
+                                # Same location, try to update the feature attributes
+                                try:
+                                    fcrows.updateRow(list(dict_row))
                                 
-                                update_count += 1
+                                    update_count += 1
 
-                                # Delete the record from the dictionary
-                                del att_dict[idVal]
+                                    # Delete the record from the dictionary
+                                    del att_dict[idVal]
 
-                            # If there is a field type mismatch between the dictionary
-                            #   value and the feature class, delete the row in the
-                            #   feature class. The spreadsheet record will be
-                            #   re-geocoded and placed in the un-appended report for
-                            #   further attention.
-                            except RuntimeError:
-                                fcrows.deleteRow()
+                                # If there is a field type mismatch between the dictionary
+                                #   value and the feature class, delete the row in the
+                                #   feature class. The spreadsheet record will be
+                                #   re-geocoded and placed in the un-appended report for
+                                #   further attention.
+                                except RuntimeError:
+                                    fcrows.deleteRow()
 
-                except KeyError:
-                    pass
+                    except KeyError:
+                        pass
         if desc.isVersioned:
             editor.stopOperation()
             editor.stopEditing(True)
@@ -714,6 +1137,12 @@ def remove_dups_fc(new_features, cur_features, fields, id_field, dt_field, loc_f
         for updaterow in updaterows:
             idVal = updaterow[id_index]
 
+            if idVal is None:
+                # Rows without an id were written to the rejected records report
+                updaterows.deleteRow()
+                del_count += 1
+                continue
+
             try:
                 if idVal.is_integer():
                     idVal = int(idVal)
@@ -723,19 +1152,11 @@ def remove_dups_fc(new_features, cur_features, fields, id_field, dt_field, loc_f
             idVal = cast_id(idVal, field_type)
 
             try:
-                id_vals = att_dict[idVal]
+                dict_date = att_dict[idVal][1]
 
-                try:
-                    dtVal = dt.strptime(updaterow[dt_index], timestamp)
-                    dtVal = dtVal.replace(microsecond=0)
-                except TypeError:
-                    dtVal = updaterow[dt_index]
-
-                try:
-                    dict_date = dt.strptime(id_vals[dt_field], timestamp)
-                    dict_date = dict_date.replace(microsecond=0)
-                except TypeError:
-                    dict_date = id_vals[dt_field]
+                dtVal = updaterow[dt_index]
+                if dtVal is not None:
+                    dtVal = _record_date(dtVal, dt_field, timestamp).replace(microsecond=0)
 
                 if not dict_date == dtVal:
                     updaterows.deleteRow()
@@ -748,59 +1169,1041 @@ def remove_dups_fc(new_features, cur_features, fields, id_field, dt_field, loc_f
 
     # Return the records to geocode
 
-    return tempTable, null_records, update_count, del_count - update_count
+    return tempTable, update_count, del_count - update_count
 
 # End remove_dups function
 
-def editFeatures(features, fl, mode, log):
-    retval = False
-    error = False
-    # add section
+def coordinate_column(values):
+    """Reads a column of coordinate values as floats.
+        Text is only read when it is a plain number. Values with a comma
+        are not read, as a thousands separator cannot be told apart from a
+        decimal comma. Returns the column, with NaN for the values that are
+        missing or are not numbers."""
     try:
-        arcpy.SetProgressor("default","Editing Features")
-        arcpy.SetProgressorLabel("Editing Features")
+        return np.array(values, dtype='float64')
+    except (TypeError, ValueError):
+        return np.array([value if isinstance(value, (int, float)) else
+                         float(value) if isinstance(value, str) and number_pattern.match(value) else
+                         None for value in values], dtype='float64')
+
+# End coordinate_column function
+
+def coordinate_bounds(sr):
+    """Returns the (xmin, ymin, xmax, ymax) range of valid coordinates
+        in a spatial reference"""
+    if sr.type == "Geographic":
+        return -180.0, -90.0, 180.0, 90.0
+
+    return tuple(float(value) for value in sr.domain.split()[:4])
+
+# End coordinate_bounds function
+
+# Latitude beyond which Mercator coordinates cannot be computed
+mercator_latitude = 85.0511287798
+
+def horizon_mask(x, y, sr_input, sr_output):
+    """Tests coordinates in sr_input against the horizon of sr_output, the
+        area that can be projected to it.
+        The horizon is approximated from the projection of sr_output: the
+        latitude limit of Mercator projections and the hemisphere around the
+        central meridian of Transverse Mercator projections. Coordinates
+        that are not geographic are tested against the domain of sr_output
+        when both spatial references are the same.
+        Returns a mask of the coordinates inside the horizon."""
+    inside = np.ones(len(x), dtype=bool)
+    with np.errstate(invalid='ignore'):
+        if sr_input.type == "Geographic" and sr_output.type == "Projected":
+            projection = sr_output.projectionName.lower()
+            if "transverse" in projection or "gauss" in projection:
+                offset = (x - sr_output.centralMeridian + 180) % 360 - 180
+                inside &= np.abs(offset) < 90
+            elif "mercator" in projection:
+                inside &= np.abs(y) <= mercator_latitude
+        elif sr_input.exportToString() == sr_output.exportToString():
+            xmin, ymin, xmax, ymax = coordinate_bounds(sr_output)
+            inside &= (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
+
+    return inside
+
+# End horizon_mask function
+
+def target_spatial_reference(target, target_feat_type):
+    """Returns the spatial reference of a target feature layer or feature class"""
+    if target_feat_type == "service":
+        extentSR = target.properties.extent['spatialReference']
         try:
-            numFeat = len(features)
-        except:
-            numFeat = 0
-        if numFeat == 0:
-            messages(m20,log)      
-            return True # nothing to add is OK
-        if numFeat > 100:
-            chunk = 100
-        else:
-            chunk = numFeat
-        featuresProcessed = 0
-        while featuresProcessed < numFeat  and error == False:
-            next = featuresProcessed + chunk
-            featuresChunk = features[featuresProcessed:next]
-            msg = retrieveMessage(m21, str(featuresProcessed), str(next))
-            arcpy.SetProgressorLabel(msg)
-            if mode == 'add':
-                result = fl.edit_features(adds=featuresChunk)
+            return arcpy.SpatialReference(extentSR['wkid'])
+        except KeyError:
+            sr = arcpy.SpatialReference()
+            sr.loadFromString(extentSR['wkt'])
+            return sr
+
+    return arcpy.Describe(target).spatialReference
+
+# End target_spatial_reference function
+
+def get_transformation(sr_input, sr_output, cache_path):
+    """Finds the geographic transformation used to project features read
+        from sr_input to sr_output. The transformation chosen for a pair of
+        geographic coordinate systems is kept in a json file at cache_path,
+        so that it is only looked up once.
+        Returns the name of the transformation, passed to the cursors that
+        read the features, or None if none is needed."""
+    gcsInput = sr_input.GCS.name
+    gcsOutput = sr_output.GCS.name
+    if gcsInput == gcsOutput:
+        return None
+
+    key = "{} > {}".format(gcsInput, gcsOutput)
+    try:
+        with open(cache_path) as cacheFile:
+            transformations = json.load(cacheFile)
+    except (IOError, ValueError):
+        transformations = {}
+
+    if key not in transformations:
+        choices = arcpy.ListTransformations(sr_input, sr_output)
+        transformations[key] = choices[0] if choices else ""
+        with open(cache_path, "w") as cacheFile:
+            json.dump(transformations, cacheFile, indent=2)
+
+    return transformations[key] or None
+
+# End get_transformation function
+
+def drop_beyond_horizon(tempFC, sr_output, sourcenames, fieldnames, rptNoAppend):
+    """Moves the features of tempFC that cannot be projected to sr_output
+        to the NotAppended report, so that the rest of the features can be
+        projected. sourcenames holds the field of tempFC read for each field
+        in fieldnames. Returns the number of features moved."""
+    sr_input = arcpy.Describe(tempFC).spatialReference
+    points = arcpy.da.FeatureClassToNumPyArray(tempFC, ["OID@", "SHAPE@X", "SHAPE@Y"], skip_nulls=True)
+    outside = points["OID@"][~horizon_mask(points["SHAPE@X"], points["SHAPE@Y"], sr_input, sr_output)]
+    if not len(outside):
+        return 0
+
+    outside = set(outside.tolist())
+    start_report(rptNoAppend, [errorfield] + fieldnames + [long_field, lat_field])
+    with open(rptNoAppend, "a") as appendFile:
+        appendwriter = csv.writer(appendFile)
+        with arcpy.da.UpdateCursor(tempFC, ["OID@", "SHAPE@XY"] + sourcenames) as rows:
+            for row in rows:
+                if row[0] in outside:
+                    appendwriter.writerow(["Extent"] + list(row[2:]) + list(row[1]))
+                    rows.deleteRow()
+
+    return len(outside)
+
+# End drop_beyond_horizon function
+
+def build_xy_features(incidents, lg_field, lt_field, coord_system, sr_output, tempFC, remove_zeros, fieldnames, rptNoAppend):
+    """Creates point features in tempFC from the X and Y values of the
+        incidents in a single read of the table.
+        The coordinates are checked a column at a time. Rows with a missing,
+        non-numeric or comma formatted value, a coordinate outside the
+        range of coord_system, a point beyond the horizon of the target
+        spatial reference sr_output, or 0,0 coordinates when remove_zeros
+        is set are written to the NotAppended report with the fields in
+        fieldnames.
+        Returns the number of points created and the number of rows
+        written to the report."""
+    sr = arcpy.SpatialReference()
+    sr.loadFromString(coord_system)
+
+    fields = [field for field in arcpy.ListFields(incidents) if field.type in add_field_types]
+    sourcenames = [field.name for field in fields]
+    with arcpy.da.SearchCursor(incidents, sourcenames) as rows:
+        records = [row for row in rows]
+
+    xIndex = sourcenames.index(lg_field)
+    yIndex = sourcenames.index(lt_field)
+    x = coordinate_column([record[xIndex] for record in records])
+    y = coordinate_column([record[yIndex] for record in records])
+
+    # Name the problem with each invalid row, with later checks taking precedence
+    xmin, ymin, xmax, ymax = coordinate_bounds(sr)
+    reasons = np.full(len(records), None, dtype=object)
+    reasons[~horizon_mask(x, y, sr, sr_output)] = "Extent"
+    with np.errstate(invalid='ignore'):
+        reasons[~((y >= ymin) & (y <= ymax))] = lt_field
+        reasons[~((x >= xmin) & (x <= xmax))] = lg_field
+        if remove_zeros:
+            reasons[(x == 0) & (y == 0)] = "Coordinates"
+    valid = np.equal(reasons, None)
+
+    arcpy.CreateFeatureclass_management(dirname(tempFC), basename(tempFC), "POINT",
+                                        spatial_reference=sr)
+    arcpy.AddFields_management(tempFC,
+                               [[field.name, add_field_types[field.type], "", field.length] for field in fields])
+
+    points = list(zip(x.tolist(), y.tolist()))
+    with arcpy.da.InsertCursor(tempFC, ["SHAPE@XY"] + sourcenames) as rows:
+        for i in np.flatnonzero(valid).tolist():
+            rows.insertRow([points[i]] + list(records[i]))
+
+    invalid = np.flatnonzero(~valid).tolist()
+    if invalid:
+        reportIndexes = [sourcenames.index(fieldname) for fieldname in fieldnames]
+        start_report(rptNoAppend, [errorfield] + fieldnames + [long_field, lat_field])
+        with open(rptNoAppend, "a") as appendFile:
+            appendwriter = csv.writer(appendFile)
+            for i in invalid:
+                record = records[i]
+                appendwriter.writerow([reasons[i]] + [record[j] for j in reportIndexes] +
+                                      [record[xIndex], record[yIndex]])
+
+    return len(records) - len(invalid), len(invalid)
+
+# End build_xy_features function
+
+def geocode_incidents(incidents, locator, addresses, loc_fields, tempFC, cache=None, geocoder=geocode_batch):
+    """Geocodes the incidents into tempFC.
+        Records whose normalized locator inputs are in the cache get the
+        cached point, Status, Addr_type, Score and Match_addr, and only the other records are
+        sent to the locator. Their results are added to the cache.
+        Records that share an address are geocoded once and the result is
+        joined back to each of them. Addresses are geocoded in batches of
+        geocode_batch_size on up to geocode_workers processes, by calling
+        geocoder with each batch.
+        Like the output of the locator, tempFC holds the source fields with
+        a USER_ prefix and the Status, Addr_type, Score and Match_addr of
+        each record.
+        Returns the number of records located from the cache and the number
+        of distinct addresses sent to the locator."""
+    workspace = dirname(tempFC)
+    fields = [field for field in arcpy.ListFields(incidents) if field.type in add_field_types]
+    fieldnames = [field.name for field in fields]
+    fieldDefs = [(field.name, add_field_types[field.type], field.length) for field in fields]
+    loc_indexes = [fieldnames.index(loc_field) for loc_field in loc_fields]
+    result_fields = [status, addr_type, score, match_addr]
+
+    with arcpy.da.SearchCursor(incidents, fieldnames) as rows:
+        records = [row for row in rows]
+    keys = [address_key([record[i] for i in loc_indexes]) for record in records]
+
+    found = {}
+    spatial_reference = None
+    if cache is not None:
+        found = cache.get_many(set(keys))
+        if found:
+            spatial_reference = arcpy.SpatialReference()
+            spatial_reference.loadFromString(cache.get_spatial_reference())
+
+    def locate(cached):
+        # Geocode each distinct address once, with the first record that has it
+        distinct = {}
+        for key, record in zip(keys, records):
+            if (key in found) == cached and key not in distinct:
+                distinct[key] = record
+        distinctKeys = list(distinct)
+        geocoded, geocodeSR = geocode_records(dict(enumerate(distinct.values())), fieldDefs, loc_indexes,
+                                              locator, addresses, result_fields,
+                                              geocode_batch_size, geocode_workers, geocoder)
+        return dict((distinctKeys[n], result) for n, result in geocoded.items()), geocodeSR
+
+    results = {}
+    if len(found) < len(set(keys)):
+        results, geocodeSR = locate(False)
+
+        # Points cached in another spatial reference cannot be mixed with the new results
+        if found and geocodeSR.exportToString() != spatial_reference.exportToString():
+            results.update(locate(True)[0])
+            found = {}
+        spatial_reference = geocodeSR
+
+        if cache is not None:
+            cache.set_spatial_reference(spatial_reference.exportToString())
+            cache.put_many(results.items())
+
+    # Build the geocoding results with the source records in their original order
+    arcpy.CreateFeatureclass_management(workspace, basename(tempFC), "POINT",
+                                        spatial_reference=spatial_reference)
+    arcpy.AddFields_management(tempFC,
+                               [["USER_" + name, field_type, "", length] for name, field_type, length in fieldDefs] +
+                               [[status, "TEXT", "", 1], [addr_type, "TEXT", "", 50],
+                                [score, "DOUBLE"], [match_addr, "TEXT", "", 500]])
+
+    countCached = 0
+    insertnames = ["SHAPE@XY"] + ["USER_" + fieldname for fieldname in fieldnames] + result_fields
+    with arcpy.da.InsertCursor(tempFC, insertnames) as rows:
+        for key, record in zip(keys, records):
+            if key in results:
+                result = results[key]
             else:
-                result = fl.edit_features(updates=featuresChunk)
-            try:
-                if result['addResults'][-1]['error'] != None:
-                    retval = False
-                    messages(e17, log, result['addResults'][-1]['error']['description'])
-                    error = True
-            except:
-                try:
-                    lenAdded = len(result['addResults'])
-                    retval = True
-                except:
-                    retval = False
-                    messages(e18, log)
-                    error = True
-            featuresProcessed += chunk
-    except:
-        retval = False
+                result = found[key]
+                countCached += 1
+            x, y = result[:2]
+            rows.insertRow([(x, y) if x is not None else None] + list(record) + list(result[2:]))
+
+    return countCached, len(results)
+
+# End geocode_incidents function
+
+def editUnits(units, fl, rollback, log):
+    """Sends units of edits to the service in concurrent applyEdits
+        batches sized by edit_batch_size and edit_batch_bytes.
+        Requests that fail with a transient error are retried, and
+        rejected batches are split to isolate the failing edits.
+        Reports the failed edits and the upload rate.
+        Returns the EditResults, or None if the upload failed."""
+    sent = [0]
+
+    def progress(count):
+        arcpy.SetProgressorLabel(retrieveMessage(m21, str(sent[0]), str(count)))
+        sent[0] = count
+
+    try:
+        results = upload_edits(fl, units, service_workers, edit_batch_size,
+                               edit_batch_bytes, rollback, progress,
+                               edit_retries, retry_delay)
+    except Exception:
         messages(e19, log)
-        error = True
+        return None
+
+    if results.failures:
+        messages(e17, log, results.failures[0][2])
+        messages(w9, log, len(results.failures), fl.url)
+
+    messages(m26, log, results.succeeded, "{:.1f}".format(results.rate))
+
+    return results
+
+def stream_features(table, fieldnames, sourcenames, converters, timestamp, spatial_reference=None,
+                    transformation=None, batch_size=stream_batch_size):
+    """Reads the features to add to a service from a table.
+        sourcenames holds the table field read for each field in fieldnames,
+        so renamed fields such as the USER_ fields of geocoding results are
+        resolved once for the whole table.
+        Rows are read batch_size at a time and their values converted with
+        the field_converters of the service fields. If spatial_reference is
+        given, the points are projected to it as they are read, with the
+        geographic transformation named by transformation.
+        Yields the features as edit dictionaries."""
+    with arcpy.da.SearchCursor(table, sourcenames + ["SHAPE@XY"], spatial_reference=spatial_reference,
+                               datum_transformation=transformation) as rows:
+        while True:
+            block = list(islice(rows, batch_size))
+            if not block:
+                break
+
+            for row, values in zip(block, convert_rows([row[:-1] for row in block], converters, timestamp)):
+                feature = {'attributes': dict(zip(fieldnames, values))}
+                x, y = row[-1]
+                if x is not None:
+                    feature['geometry'] = {'x': x, 'y': y}
+                yield feature
+
+# End stream_features function
+
+def write_failed_edits(results, rptNoAppend, fieldnames, log):
+    """Appends the features that could not be added or updated to the
+        NotAppended report with the reason each edit failed"""
+    if not results or not results.failures:
+        return 0
+
+    start_report(rptNoAppend, [errorfield] + fieldnames + [long_field, lat_field])
+    countFailed = 0
+    with open(rptNoAppend, "a") as appendFile:
+        appendwriter = csv.writer(appendFile)
+
+        for mode, edit, description in results.failures:
+            if mode == "delete":
+                continue
+            if isinstance(edit, dict):
+                attributes = edit.get('attributes') or {}
+                geometry = edit.get('geometry') or {}
+            else:
+                attributes = edit.attributes or {}
+                geometry = edit.geometry or {}
+            row = [description]
+            row.extend(attributes.get(fieldname) for fieldname in fieldnames)
+            row.extend([geometry.get('x'), geometry.get('y')])
+            appendwriter.writerow(row)
+            countFailed += 1
+
+    if countFailed:
+        messages(w1, log, countFailed, rptNoAppend)
+
+    return countFailed
+
+def editFeatures(features, fl, mode, log):
+    """Sends features to the service in applyEdits batches.
+        mode is 'add', 'update' or 'delete'. Deletes are object ids.
+        Returns the EditResults, or None if nothing was sent."""
+    arcpy.SetProgressor("default","Editing Features")
+    arcpy.SetProgressorLabel("Editing Features")
+    try:
+        numFeat = len(features)
+    except TypeError:
+        numFeat = None # features are read as they are sent
+    if numFeat == 0:
+        messages(m20,log)
+        return None # nothing to add is OK
+
+    position = edit_modes.index(mode)
+    units = (tuple([feature] if i == position else [] for i in range(0, 3)) for feature in features)
+
+    return editUnits(units, fl, False, log)
+
+def editChangeSet(changeset, fl, id_field, rollback, log):
+    """Sends the adds, updates and deletes of a run to the service in
+        combined applyEdits requests.
+        A deleted feature is sent in the same request as the new
+        feature that replaces it, so that with rollback enabled a
+        feature is never deleted without being added again."""
+
+    # Pair each deleted feature with the feature that replaces it
+    deleted_ids = set(key for key, oid in changeset['deletes'])
+    replacements = {}
+    adds = []
+    for feature in changeset['adds']:
+        key = id_key(feature['attributes'].get(id_field))
+        if key in deleted_ids and key not in replacements:
+            replacements[key] = feature
+        else:
+            adds.append(feature)
+
+    # Group the edits into units that are always sent together
+    units = []
+    for key, oid in changeset['deletes']:
+        if key in replacements:
+            units.append(([replacements.pop(key)], [], [oid]))
+        else:
+            units.append(([], [], [oid]))
+    units.extend(([], [feature], []) for feature in changeset['updates'])
+    units.extend(([feature], [], []) for feature in adds)
+
+    if not units:
+        messages(m20, log)
+        return None
+
+    arcpy.SetProgressor("default","Editing Features")
+
+    return editUnits(units, fl, rollback, log)
+
+def source_size(table):
+    """Estimates the bytes of a source table. Files are measured on disk
+        and other tables from their number of rows and fields"""
+    if isfile(table):
+        return getsize(table)
+
+    rows = int(arcpy.GetCount_management(table).getOutput(0))
+    return rows * len(arcpy.ListFields(table)) * staging_value_bytes
+
+# End source_size function
+
+def staging_workspace(table, scratch):
+    """Chooses the workspace of the intermediate datasets of a run.
+        Returns the memory workspace, or scratch when memory staging is off
+        or the table is larger than memory_staging_limit, and the
+        estimated bytes of the table"""
+    size = source_size(table)
+    if memory_staging and size <= memory_staging_limit * 1048576:
+        return "memory", size
+
+    return scratch, size
+
+# End staging_workspace function
+
+def peak_memory():
+    """Returns the peak memory use of the process in megabytes, read from
+        the peak working set on Windows (with psutil) or the maximum
+        resident set size elsewhere, or None when it cannot be measured"""
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        if hasattr(info, "peak_wset"):
+            return round(info.peak_wset / 1048576.0, 1)
+
+    if resource is None:
+        return None
+
+    # ru_maxrss is in kilobytes, except on macOS where it is in bytes
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        peak *= 1024
+    return round(peak / 1048576.0, 1)
+
+# End peak_memory function
+
+# schema.ini column types that keep the field types of a csv source table
+#   in the files of its blocks of rows. schema.ini has no 64 bit integer
+#   type, so big integers are kept as text rather than rounded.
+schema_types = {'String': 'Text', 'Integer': 'Long', 'SmallInteger': 'Short',
+                'BigInteger': 'Text Width 20', 'Double': 'Double', 'Single': 'Double',
+                'Date': 'DateTime', 'DateOnly': 'DateTime'}
+
+# Format of the dates written to the files of blocks of rows, in Python
+#   and in schema.ini
+chunk_date_format = "%Y-%m-%d %H:%M:%S"
+schema_date_format = "yyyy-mm-dd hh:nn:ss"
+
+def csv_fields(table):
+    """Returns the fields of a csv table in the order of its columns"""
+    return [f for f in arcpy.ListFields(table) if f.type != "OID"]
+
+# End csv_fields function
+
+def latest_csv_rows(table, id_field, dt_field, split_decimals, timestamp):
+    """Reads a csv table once to find the most recent report of each id,
+        with the same rules as a whole table import. Rows without an id or
+        date are kept, to be reported with the rest of their block.
+        Returns the set of row numbers of older reports."""
+    latest = {}
+    skip = set()
+    with arcpy.da.SearchCursor(table, [id_field, dt_field]) as rows:
+        for number, (idVal, dtVal) in enumerate(rows):
+            if idVal is None or dtVal is None:
+                continue
+
+            older = _keep_latest(latest, _source_id(idVal, split_decimals), number, dtVal, dt_field, timestamp)
+            if older is not None:
+                skip.add(older)
+
+    return skip
+
+# End latest_csv_rows function
+
+def remove_file(path):
+    """Deletes a file, if it exists and is not locked"""
+    try:
+        remove(path)
+    except OSError:
         pass
 
-    return retval
+# End remove_file function
+
+def chunk_value(value):
+    """Formats a value read from a csv table for the file of a block"""
+    if isinstance(value, date):
+        return value.strftime(chunk_date_format)
+    return value
+
+# End chunk_value function
+
+def csv_chunks(table, fields, chunk_rows, folder, skip=frozenset()):
+    """Copies the rows of a csv table to files of chunk_rows rows in folder,
+        leaving out the row numbers in skip, and yields the path of each
+        file in turn. The rows are read with the same cursor as
+        latest_csv_rows, so that they are numbered and decoded the same
+        way, and written as UTF-8. A schema.ini file gives every file the
+        field types of the source table. Each file is deleted once the next
+        one is requested."""
+    schemaPath = join(folder, "schema.ini")
+    columns = ["Format=CSVDelimited", "ColNameHeader=True", "CharacterSet=65001",
+               "DateTimeFormat={}".format(schema_date_format)]
+    for number, field in enumerate(fields, 1):
+        fieldType = schema_types.get(field.type, "Text")
+        if fieldType == "Text":
+            fieldType += " Width {}".format(field.length)
+        columns.append('Col{}="{}" {}'.format(number, field.name, fieldType))
+
+    chunkPath = None
+    try:
+        header = [field.name for field in fields]
+        with open(schemaPath, "w") as schemaFile, arcpy.da.SearchCursor(table, header) as source:
+            rows = ([chunk_value(value) for value in row] for number, row in enumerate(source) if number not in skip)
+
+            for number, block in enumerate(iter(lambda: list(islice(rows, chunk_rows)), [])):
+                chunkName = "chunk_{}.csv".format(number)
+                schemaFile.write("[{}]\n{}\n".format(chunkName, "\n".join(columns)))
+                schemaFile.flush()
+
+                chunkPath = join(folder, chunkName)
+                with open(chunkPath, "w", newline='', encoding='utf8') as chunkFile:
+                    writer = csv.writer(chunkFile)
+                    writer.writerow(header)
+                    writer.writerows(block)
+
+                yield chunkPath
+
+                remove_file(chunkPath)
+                chunkPath = None
+    finally:
+        for leftover in (chunkPath, schemaPath):
+            if leftover is not None:
+                remove_file(leftover)
+
+# End csv_chunks function
+
+def write_summary(log, total, counts, source, summary_field):
+    """Logs the number of records found in the source table and the number
+        of records with each value of the summary field"""
+    messages(m17, log, total, source)
+
+    if not summary_field == "":
+        nulls = counts.pop(None, 0)
+        if nulls:
+            messages(m19, log, nulls)
+
+        log.write(retrieveMessage(l10,summary_field)+ '\n')
+        for value in sorted(counts):
+            log.write(retrieveMessage(l11,value, counts[value])+ '\n')
+
+        log.write("\n")
+
+# End write_summary function
+
+def import_table(incidents, staging, cfg, inc_features, id_field, report_date_field, summary_field,
+                 delete_duplicates, fieldmap_option, fieldmap, timestamp, loc_type, target_feat_type,
+                 fl, serviceIds, reports, fileNow, rptNoAppend, summaryCounts, log,
+                 summary_source=None):
+    """Imports a source table, or one block of rows of a chunked csv table,
+        to the target features: maps its fields, removes duplicate reports,
+        locates the incidents and adds or updates them in the target.
+        Intermediate datasets are created in the staging workspace.
+        The values of the summary field are counted in summaryCounts, and
+        the summary is logged for the summary_source table if it is given.
+        Returns the number of records in the table."""
+    timeNow = dt.strftime(dt.now(), time_format)
+
+    # Create Field Mapping Object and Map incidents to new table with new schema    
+    if fieldmap_option == "Use Field Mapping":
+        messages(m2, log, timeNow)
+        afm = arcpy.FieldMappings()
+        for key, value in fieldmap.items():
+            tempFieldMap = arcpy.FieldMap()
+            tempFieldMap.mergeRule = "First"
+            tempFieldMap.outputField = arcpy.ListFields(inc_features, value['target'])[0]
+            tempFieldMap.addInputField(incidents, key)
+            afm.addFieldMap(tempFieldMap)  
+        timeNow = dt.strftime(dt.now(), time_format)
+        messages(m6, log,timeNow)
+        incidents = arcpy.TableToTable_conversion(incidents, staging, "schemaTable",field_mapping=afm)
+
+    # Identify field names in both fc and csv
+    sourcefieldnames = [f.name for f in arcpy.ListFields(incidents)]
+    targetfieldnames = [f.name for f in arcpy.ListFields(inc_features)]
+
+    matchfieldnames = [fieldname for fieldname in sourcefieldnames if fieldname in targetfieldnames]
+
+    #Dont compare objectid values because they will likely be different and will cause updates
+    # to be sent to service when its not necessary
+    oidFieldName = arcpy.Describe(inc_features).oidFieldName
+    if oidFieldName in matchfieldnames:
+        matchfieldnames.remove(oidFieldName)
+
+    # If data is to be geocoded
+    if loc_type == "ADDRESSES":
+
+        # Get geocoding parameters
+        address_field = cfg.get('ADDRESSES', 'address_field')
+        city_field = cfg.get('ADDRESSES', 'city_field')
+        state_field = cfg.get('ADDRESSES', 'state_field')
+        zip_field = cfg.get('ADDRESSES', 'zip_field')
+        locator = cfg.get('ADDRESSES', 'locator')
+
+        # Geocoding field names
+        reqFields = [address_field, id_field]#, report_date_field]
+        opFields = [city_field, state_field, zip_field, summary_field, report_date_field]
+
+        if locator == "":
+            raise Exception(retrieveMessage(e13))
+
+        # Test geolocator fields
+        loc_address_fields = [loc_address_field, loc_city_field, loc_zip_field, loc_state_field]
+        for a in loc_address_fields:
+            if not a == "":
+                if not a in all_locator_fields:
+                    raise Exception(retrieveMessage(e14))
+
+    # If data has coordinate values
+    else:
+
+        # Get coordinate parameters
+        lg_field = cfg.get('COORDINATES', 'Xfield')
+        lt_field = cfg.get('COORDINATES', 'Yfield')
+        coord_system = cfg.get('COORDINATES', 'coord_system')
+        remove_zeros = cfg.get('COORDINATES', 'ignore_zeros')
+        if remove_zeros in ('true', 'True'):
+            remove_zeros = True
+        if remove_zeros in ('false', 'False'):
+            remove_zeros = False
+
+        # Coordinate field names
+        reqFields = [id_field, lg_field, lt_field]#, report_date_field]
+        opFields = [summary_field, report_date_field]
+
+    # Validate required field names
+    field_test(incidents, reqFields, sourcefieldnames, True)
+    field_test(inc_features, reqFields, targetfieldnames, True)
+
+    # Validate optional field names
+    field_test(incidents, opFields, sourcefieldnames)
+    field_test(inc_features, opFields, targetfieldnames)
+
+    # Validate the types of the fields copied to the point features
+    field_type_test(incidents, matchfieldnames + [field for field in reqFields + opFields if field])
+
+    # Get address fields for geocoding
+    if loc_type == "ADDRESSES":
+        addresses = ""
+        loc_fields = []
+        if not city_field and not state_field and not zip_field:
+            addresses = "'Single Line Input' {0} VISIBLE NONE".format(address_field)
+            loc_fields.append(address_field)
+        else:
+            adr_string = "{0} {1} VISIBLE NONE;"
+
+            for loc_field in all_locator_fields:
+                if loc_field == loc_address_field:
+                    addresses += adr_string.format(loc_field, address_field)
+                    loc_fields.append(address_field)
+
+                elif loc_field == loc_city_field and city_field != "":
+                    addresses += adr_string.format(loc_field, city_field)
+                    loc_fields.append(city_field)
+
+                elif loc_field == loc_state_field and state_field != "":
+                    addresses += adr_string.format(loc_field, state_field)
+                    loc_fields.append(state_field)
+
+                elif loc_field == loc_zip_field and zip_field != "":
+                    addresses += adr_string.format(loc_field, zip_field)
+                    loc_fields.append(zip_field)
+
+                else:
+                    addresses += adr_string.format(loc_field, "<None>")
+
+    # Get coordinate fields
+    else:
+        loc_fields = [lg_field, lt_field]
+
+    countRecords = len(field_vals(incidents,id_field))
+    if not summary_field == "":
+        summaryCounts.update(field_vals(incidents, summary_field))
+
+    if summary_source is not None:
+        write_summary(log, countRecords, summaryCounts, summary_source, summary_field)
+
+    # Edits held to be sent to the service in combined requests
+    changeset = None
+    if target_feat_type == "service" and apply_edits_together:
+        changeset = {'adds': [], 'updates': [], 'deletes': []}
+
+    # Remove duplicate incidents
+    if delete_duplicates:
+        timeNow = dt.strftime(dt.now(), time_format)
+        messages(m13, log, timeNow)
+
+        # Records that cannot be processed are written to a report as they are found
+        rptReject = join(reports, "{0}_{1}.csv".format(fileNow, reject_name))
+        with RejectedRecords(rptReject, matchfieldnames) as rejects:
+            if target_feat_type == "service":
+                incidents, countUpdate, countDelete = remove_dups_fs(incidents,
+                                                                     fl,
+                                                                     matchfieldnames,
+                                                                     id_field,
+                                                                     report_date_field,
+                                                                     loc_fields,
+                                                                     timestamp,
+                                                                     rejects,
+                                                                     log,
+                                                                     changeset,
+                                                                     staging,
+                                                                     serviceIds,
+                                                                     rptNoAppend)
+            else:
+                incidents, countUpdate, countDelete = remove_dups_fc(incidents,
+                                                                     inc_features,
+                                                                     matchfieldnames,
+                                                                     id_field,
+                                                                     report_date_field,
+                                                                     loc_fields,
+                                                                     timestamp,
+                                                                     rejects,
+                                                                     staging)
+
+        if rejects.count > 0:
+            messages(w3, log, rejects.count, rptReject)
+
+        if not countUpdate == 0:
+            messages(m14, log, countUpdate,inc_features)
+
+        if countDelete > 0:
+            messages(m15, log, countDelete,inc_features)
+
+    # Create features
+    tempFC = join(staging, "tempDataLE")
+
+    # Create point features from spreadsheet
+
+    timeNow = dt.strftime(dt.now(), time_format)
+    messages(m1, log, timeNow)
+
+    records_to_add = 0
+    for r in arcpy.da.SearchCursor(incidents, id_field):
+        records_to_add += 1
+
+    if records_to_add > 0:
+        # Spatial reference the features will be projected to
+        if target_feat_type == "service":
+            sr_target = target_spatial_reference(fl, target_feat_type)
+        else:
+            sr_target = target_spatial_reference(inc_features, target_feat_type)
+
+        if loc_type == "ADDRESSES":
+
+            timeNow = dt.strftime(dt.now(), time_format)
+            messages(m3, log, timeNow)
+
+            # Geocode the incidents, reusing the results of earlier runs
+            cache = None
+            if geocode_cache:
+                cache = GeocodeCache(join(reports, geocode_cache_name),
+                                     locator,
+                                     geocode_cache_days,
+                                     geocode_cache_size)
+            try:
+                countCached, countDistinct = geocode_incidents(incidents,
+                                                               locator,
+                                                               addresses,
+                                                               loc_fields,
+                                                               tempFC,
+                                                               cache)
+            finally:
+                if cache is not None:
+                    cache.close()
+
+            if cache is not None:
+                messages(m27, log, countCached, "{:.1%}".format(countCached / records_to_add))
+
+            if countDistinct:
+                messages(m28, log, records_to_add - countCached, countDistinct)
+
+            # Initiate geocoding report counts
+            countMatch = 0
+            countTrueMatch = 0
+            countUnmatch = 0
+
+            # Create geocoding reports
+            rptUnmatch = join(reports, "{0}_{1}.csv".format(
+                                                    fileNow, unmatch_name))
+
+            fieldnames = [f.name for f in arcpy.ListFields(tempFC)]
+
+            # Sort incidents based on match status
+            statusIndex = fieldnames.index(status)
+            locIndex = fieldnames.index(addr_type)
+
+            # Write incidents that were not well geocoded to file and
+            #       delete from temp directory
+            start_report(rptUnmatch, fieldnames)
+            with open (rptUnmatch, "a", encoding='utf8') as umatchFile:
+                unmatchwriter = csv.writer(umatchFile)
+
+                # Delete incidents that were not Matched, or not matched
+                #   to an acceptable accuracy
+                countUnmatch, countMatch, countTrueMatch = classify_records(tempFC, unmatchwriter,
+                                                                            statusIndex, locIndex)
+
+                if not countUnmatch == 0:
+                    messages(w6, log, countUnmatch, rptUnmatch)
+
+                if not countMatch == 0:
+                    messages(w7, log, countMatch, rptUnmatch)
+
+                #Change records to add value to successful geocodes # for reporting in log
+                records_to_add = countTrueMatch
+
+                messages(m16, log, countTrueMatch, inc_features)
+
+            # Move points that cannot be projected to the target features
+            #   to the report of records not appended
+            countExtent = drop_beyond_horizon(tempFC,
+                                              sr_target,
+                                              ["USER_" + fieldname for fieldname in matchfieldnames],
+                                              matchfieldnames,
+                                              rptNoAppend)
+            if countExtent:
+                records_to_add -= countExtent
+                messages(w1, log, countExtent, rptNoAppend)
+
+        else:
+            # Create points from the coordinates, moving rows with invalid
+            #   coordinates to the report of records not appended
+            records_to_add, countInvalid = build_xy_features(incidents,
+                                                             lg_field,
+                                                             lt_field,
+                                                             coord_system,
+                                                             sr_target,
+                                                             tempFC,
+                                                             remove_zeros,
+                                                             matchfieldnames,
+                                                             rptNoAppend)
+
+            if countInvalid:
+                messages(w1, log, countInvalid, rptNoAppend)
+
+        #Checking if records to add value has been changed by geocoding results countTrueMatch
+        if records_to_add > 0:
+            timeNow = dt.strftime(dt.now(), time_format)
+            messages(m4, log, timeNow, records_to_add)
+
+            arcpy.SetProgressor("default", "Preparing features to be sent to Target")
+
+            # Fields that will be copied from geocode results to final fc
+            copyfieldnames = []
+            copyfieldnames.extend(matchfieldnames)
+            copyfieldnames.append("SHAPE@XY")
+
+            # Fields for error reporting
+            errorfieldnames = []
+            errorfieldnames.extend(matchfieldnames)
+            errorfieldnames.insert(0, errorfield)
+            errorfieldnames += [long_field, lat_field]
+
+
+
+
+            if target_feat_type == "service":
+
+                # Reproject the features, as they are read or to a copy of them
+                transformation = None
+                if project_on_read:
+                    transformation = get_transformation(arcpy.Describe(tempFC).spatialReference,
+                                                        sr_target,
+                                                        join(reports, transformation_cache_name))
+                    proj_out = tempFC
+                    sr_read = sr_target
+                else:
+                    proj_out = "{}_proj".format(tempFC)
+                    arcpy.Project_management(tempFC, proj_out, sr_target)
+                    sr_read = None
+
+                #Plan the conversion of each field sent to the service
+                converters = field_converters(fl.properties.fields, matchfieldnames)
+
+                #Geocoding adds 'USER_' to the names of the source fields
+                if loc_type == "ADDRESSES":
+                    sourcenames = ["USER_" + fieldname for fieldname in matchfieldnames]
+                else:
+                    sourcenames = list(matchfieldnames)
+
+                #Read the features to send straight from the projected features
+                fset = stream_features(proj_out, matchfieldnames, sourcenames, converters, timestamp,
+                                       sr_read, transformation)
+
+                arcpy.ResetProgressor()
+                arcpy.SetProgressor("default", "Appending features to target features" )
+
+                if changeset is not None:
+                    changeset['adds'].extend(fset)
+                else:
+                    #Send new features to service in batches of 100
+                    results = editFeatures(fset, fl, "add", log)
+                    write_failed_edits(results, rptNoAppend, matchfieldnames, log)
+            else:
+                # Reproject the features
+                sr_input = arcpy.Describe(tempFC).spatialReference
+                sr_output = sr_target
+                sr_read = None
+                transformation = None
+
+                if sr_input.exportToString() != sr_output.exportToString():
+                    if project_on_read:
+                        # Project the features as they are read
+                        transformation = get_transformation(sr_input, sr_output,
+                                                            join(reports, transformation_cache_name))
+                        sr_read = sr_output
+
+                    else:
+                        proj_out = "{}_proj".format(tempFC)
+
+                        try:
+                            arcpy.Project_management(tempFC,
+                                                    proj_out,
+                                                    sr_output)
+                            tempFC = proj_out
+                        except arcpy.ExecuteError:
+                            timeNow = dt.strftime(dt.now(), time_format)
+                            messages(w8, log, timeNow)
+
+                # Append geocode results to fc
+
+                if loc_type == "ADDRESSES":
+                    geocodefieldnames = ["USER_" + fieldname for fieldname in copyfieldnames[:-1]]
+                    geocodefieldnames.append("SHAPE@XY")
+                    searchnames = geocodefieldnames
+                else:
+                    searchnames = copyfieldnames
+
+                desc = arcpy.Describe(inc_features)
+                if desc.isVersioned:
+                    editor = arcpy.da.Editor(desc.path)
+                    editor.startEditing()
+                    editor.startOperation()                                            
+
+                with arcpy.da.SearchCursor(tempFC, searchnames, spatial_reference=sr_read,
+                                           datum_transformation=transformation) as csvrows:
+                    with arcpy.da.InsertCursor(inc_features, copyfieldnames) as incrows:
+                        # Open csv for un-appended records
+                        start_report(rptNoAppend, errorfieldnames)
+                        with open(rptNoAppend, "a") as appendFile:
+
+                            appendwriter = csv.writer(appendFile)
+
+                            # Index of field with incident ID
+                            record = errorfieldnames.index(id_field)
+
+                            # Initiate count of successfully appended records
+                            countAppend = 0
+
+                            # List of ids of records not successfully appended
+                            errorRecords = []
+
+                            for csvrow in csvrows:
+                                try:
+                                    # If the row can be appended
+                                    incrows.insertRow(csvrow)
+                                    countAppend += 1
+
+                                except Exception as reason:
+                                    # e.g. 'The value type is incompatible with the
+                                    #       field type. [INCIDENTDAT]'
+                                    #   Invalid coordinates were already
+                                    #   reported when the points were created
+
+                                    # Get the name of the problem field
+                                    badfield = str(reason).split(" ")[-1]
+                                    badfield = badfield.strip(" []")
+
+                                    # Append field name to start of record
+                                    csvrow = list(csvrow)
+                                    csvrow.insert(0, badfield)
+
+                                    # Split the coordinate tuple into X and Y
+                                    lng, lat = list(csvrow[-1])
+                                    csvrow[-1] = lng
+                                    csvrow.append(lat)
+                                    csvrow = tuple(csvrow)
+
+                                    # Write the record out to csv
+                                    appendwriter.writerow(csvrow)
+
+                                    # Add id and field to issue list
+                                    errorRecords.append(retrieveMessage(w4,csvrow[record], badfield))
+
+                # If issues were reported, print them
+                if len(errorRecords) != 0:
+                    messages(w1, log, len(errorRecords), rptNoAppend)
+
+                messages(m18, log, countAppend, inc_features)
+
+                del incrows, csvrows
+
+                if desc.isVersioned:
+                    editor.stopOperation()
+                    editor.stopEditing(True)
+                    del editor
+
+    # Send all edits for the run to the service together
+    if changeset is not None:
+        results = editChangeSet(changeset, fl, id_field, rollback_on_failure, log)
+        write_failed_edits(results, rptNoAppend, matchfieldnames, log)
+
+    return countRecords
+
+# End import_table function
 
 def main(config_file, *args):
     """
@@ -855,8 +2258,18 @@ def main(config_file, *args):
     else:
         raise Exception(retrieveMessage(e1,"Report location", reports))
 
+    # Records that cannot be added to or updated in the target features
+    rptNoAppend = join(reports, "{0}_{1}.csv".format(fileNow, noappend_name))
+
     # Scratch workspace
     tempgdb = arcpy.env.scratchGDB
+    staging = tempgdb
+
+    # Target feature layer, when the target features are a service
+    fl = None
+
+    # Blocks of rows of a chunked csv import
+    chunks = None
 
     with open(rptLog, "w") as log:
         try:
@@ -891,519 +2304,92 @@ def main(config_file, *args):
                 if not fl.properties.geometryType == 'esriGeometryPoint':
                     raise Exception(retrieveMessage(e6))
 
-            timeNow = dt.strftime(dt.now(), time_format)
-            
-            # Create Field Mapping Object and Map incidents to new table with new schema    
+            # Source fields and target fields of the field mapping
             if fieldmap_option == "Use Field Mapping":
-                messages(m2, log, timeNow)
                 fieldmap = processFieldMap(fieldmap)
-                afm = arcpy.FieldMappings()
-                for key, value in fieldmap.items():
-                    tempFieldMap = arcpy.FieldMap()
-                    tempFieldMap.mergeRule = "First"
-                    tempFieldMap.outputField = arcpy.ListFields(inc_features, value['target'])[0]
-                    tempFieldMap.addInputField(incidents, key)
-                    afm.addFieldMap(tempFieldMap)  
-                timeNow = dt.strftime(dt.now(), time_format)
-                messages(m6, log,timeNow)
-                incidents = arcpy.TableToTable_conversion(incidents, tempgdb, "schemaTable",field_mapping=afm)
-
-            # Identify field names in both fc and csv
-            sourcefieldnames = [f.name for f in arcpy.ListFields(incidents)]
-            targetfieldnames = [f.name for f in arcpy.ListFields(inc_features)]
-
-            matchfieldnames = [fieldname for fieldname in sourcefieldnames if fieldname in targetfieldnames]
-            
-            #Dont compare objectid values because they will likely be different and will cause updates
-            # to be sent to service when its not necessary
-            oidFieldName = arcpy.Describe(inc_features).oidFieldName
-            if oidFieldName in matchfieldnames:
-                matchfieldnames.remove(oidFieldName)
-
-            # If data is to be geocoded
-            if loc_type == "ADDRESSES":
-
-                # Get geocoding parameters
-                address_field = cfg.get('ADDRESSES', 'address_field')
-                city_field = cfg.get('ADDRESSES', 'city_field')
-                state_field = cfg.get('ADDRESSES', 'state_field')
-                zip_field = cfg.get('ADDRESSES', 'zip_field')
-                locator = cfg.get('ADDRESSES', 'locator')
-
-                # Geocoding field names
-                reqFields = [address_field, id_field]#, report_date_field]
-                opFields = [city_field, state_field, zip_field, summary_field, report_date_field]
-
-                if locator == "":
-                    raise Exception(retrieveMessage(e13))
-
-                # Test geolocator fields
-                loc_address_fields = [loc_address_field, loc_city_field, loc_zip_field, loc_state_field]
-                for a in loc_address_fields:
-                    if not a == "":
-                        if not a in all_locator_fields:
-                            raise Exception(retrieveMessage(e14))
-
-            # If data has coordinate values
-            else:
-
-                # Get coordinate parameters
-                lg_field = cfg.get('COORDINATES', 'Xfield')
-                lt_field = cfg.get('COORDINATES', 'Yfield')
-                coord_system = cfg.get('COORDINATES', 'coord_system')
-                remove_zeros = cfg.get('COORDINATES', 'ignore_zeros')
-                if remove_zeros in ('true', 'True'):
-                    remove_zeros = True
-                if remove_zeros in ('false', 'False'):
-                    remove_zeros = False
-
-                # Coordinate field names
-                reqFields = [id_field, lg_field, lt_field]#, report_date_field]
-                opFields = [summary_field, report_date_field]
-
-            # Validate required field names
-            field_test(incidents, reqFields, sourcefieldnames, True)
-            field_test(inc_features, reqFields, targetfieldnames, True)
-
-            # Validate optional field names
-            field_test(incidents, opFields, sourcefieldnames)
-            field_test(inc_features, opFields, targetfieldnames)
-
-            # Get address fields for geocoding
-            if loc_type == "ADDRESSES":
-                addresses = ""
-                loc_fields = []
-                if not city_field and not state_field and not zip_field:
-                    addresses = "'Single Line Input' {0} VISIBLE NONE".format(address_field)
-                    loc_fields.append(address_field)
-                else:
-                    adr_string = "{0} {1} VISIBLE NONE;"
-
-                    for loc_field in all_locator_fields:
-                        if loc_field == loc_address_field:
-                            addresses += adr_string.format(loc_field, address_field)
-                            loc_fields.append(address_field)
-
-                        elif loc_field == loc_city_field and city_field != "":
-                            addresses += adr_string.format(loc_field, city_field)
-                            loc_fields.append(city_field)
-
-                        elif loc_field == loc_state_field and state_field != "":
-                            addresses += adr_string.format(loc_field, state_field)
-                            loc_fields.append(state_field)
-
-                        elif loc_field == loc_zip_field and zip_field != "":
-                            addresses += adr_string.format(loc_field, zip_field)
-                            loc_fields.append(zip_field)
-
-                        else:
-                            addresses += adr_string.format(loc_field, "<None>")
-
-            # Get coordinate fields
-            else:
-                loc_fields = [lg_field, lt_field]
-
-            total_records = len(field_vals(incidents,id_field))
-
-            messages(m17, log,total_records, orig_incidents)
-
-            if not summary_field == "":
-                SumVals = field_vals(incidents, summary_field)
-                listSumVals = [val for val in SumVals if val != None]
-
-                if not len(SumVals) == len(listSumVals):
-                    messages(m19, log, len(SumVals)-len(listSumVals))
-                listSumVals.sort()
-
-                log.write(retrieveMessage(l10,summary_field)+ '\n')
-                dateCount = 1
-                i = 0
-                n = len(listSumVals)
-
-                while i < n:
-
-                    try:
-                        if listSumVals[i] == listSumVals[i + 1]:
-                            dateCount += 1
-                        else:
-                            log.write(retrieveMessage(l11,listSumVals[i], dateCount)+ '\n')
-                            dateCount = 1
-                    except:
-                        log.write(retrieveMessage(l11,listSumVals[i], dateCount)+ '\n')
-                    i += 1
-
-                log.write("\n")
-
-            # Remove duplicate incidents
-            if delete_duplicates:
-                timeNow = dt.strftime(dt.now(), time_format)
-                messages(m13, log, timeNow)
-
-                if target_feat_type == "service":
-                    incidents, req_nulls, countUpdate, countDelete = remove_dups_fs(incidents,
-                                                                                    fl,
-                                                                                    matchfieldnames,
-                                                                                    id_field,
-                                                                                    report_date_field,
-                                                                                    loc_fields,
-                                                                                    timestamp,
-                                                                                    log)
-                else:
-                    incidents, req_nulls, countUpdate, countDelete = remove_dups_fc(incidents,
-                                                                                    inc_features,
-                                                                                    matchfieldnames,
-                                                                                    id_field,
-                                                                                    report_date_field,
-                                                                                    loc_fields,
-                                                                                    timestamp)
-
-                if not req_nulls == "":
-                    req_nulls = "{}\n".format(req_nulls)
-                    messages(w3, log, req_nulls)
-
-                if not countUpdate == 0:
-                    messages(m14, log, countUpdate,inc_features)
-
-                if countDelete > 0:
-                    messages(m15, log, countDelete,inc_features)
-
-            # Create features
-            tempFC = join(tempgdb, "tempDataLE")
-
-            # Create point features from spreadsheet
-
-            timeNow = dt.strftime(dt.now(), time_format)
-            messages(m1, log, timeNow)
-
-            records_to_add = 0
-            for r in arcpy.da.SearchCursor(incidents, id_field):
-                records_to_add += 1
-
-            if records_to_add > 0:
-                if loc_type == "ADDRESSES":
-
-                    timeNow = dt.strftime(dt.now(), time_format)
-                    messages(m3, log, timeNow)
-
-                    # Geocode the incidents
-                    arcpy.GeocodeAddresses_geocoding(incidents,
-                                                        locator,
-                                                        addresses,
-                                                        tempFC,
-                                                        "STATIC")
-                    
-                    # Initiate geocoding report counts
-                    countMatch = 0
-                    countTrueMatch = 0
-                    countUnmatch = 0
-
-                    # Create geocoding reports
-                    rptUnmatch = join(reports, "{0}_{1}.csv".format(
-                                                            fileNow, unmatch_name))
-
-                    fieldnames = [f.name for f in arcpy.ListFields(tempFC)]
-
-                    # Sort incidents based on match status
-                    statusIndex = fieldnames.index(status)
-                    locIndex = fieldnames.index(addr_type)
-
-                    # Write incidents that were not well geocoded to file and
-                    #       delete from temp directory
-                    with open (rptUnmatch, "w", encoding='utf8') as umatchFile:
-                        unmatchwriter = csv.writer(umatchFile)
-                        unmatchwriter.writerow(fieldnames)
-
-                        # Delete incidents that were not Matched
-                        countUnmatch = sort_records(tempFC, unmatchwriter,
-                                                    statusIndex, match_value,
-                                                    False, True)
-                        
-                        if not countUnmatch == 0:
-                            messages(w6, log, countUnmatch, rptUnmatch)
-
-                        # Incidents that were not matched to an acceptable accuracy
-                        countMatch = sort_records(tempFC, unmatchwriter,
-                                                    locIndex, addrOK, False, True)
-
-                        if not countMatch == 0:
-                            messages(w7, log, countMatch, rptUnmatch)
-
-                        countTrueMatch = len(field_vals(tempFC, "OBJECTID"))
 
-                        #Change records to add value to successful geocodes # for reporting in log
-                        records_to_add = countTrueMatch
-
-                        messages(m16, log, countTrueMatch, inc_features)
-
-                else:
-                    # Create temporary output storage
-                    tempFL = arcpy.MakeXYEventLayer_management(incidents,
-                                                                lg_field,
-                                                                lt_field,
-                                                                "tempLayerLE",
-                                                                coord_system)
-
-                    # Convert the feature layer to a feature class to prevent
-                    #   field name changes
-
-                    arcpy.CopyFeatures_management(tempFL, tempFC)
-                    arcpy.Delete_management(tempFL)
-                
-                #Checking if records to add value has been changed by geocoding results countTrueMatch
-                if records_to_add > 0:
+            # Large csv source tables are imported in blocks of rows, once the
+            #   most recent report of each id in the whole table is known
+            chunked = (csv_chunk_rows > 0 and splitext(incidents)[1].lower() in (".csv", ".txt")
+                       and source_size(incidents) > csv_chunk_limit * 1048576)
+            countSkip = 0
+            serviceIds = None
+            if chunked:
+                messages(m31, log, orig_incidents, csv_chunk_rows)
+                csvFields = csv_fields(incidents)
+                skipRows = frozenset()
+                if delete_duplicates:
+                    # Look for reports that already exist in the service
+                    #   while the source table is read
+                    with ThreadPoolExecutor(1) as background:
+                        if target_feat_type == "service":
+                            inventory = background.submit(fetch_id_inventory, fl, id_field,
+                                                          inventory_page_size, service_workers)
+
+                        # Names of the id and date fields in the source table
+                        sourceNames = {}
+                        if fieldmap_option == "Use Field Mapping":
+                            sourceNames = {value['target']: key for key, value in fieldmap.items()}
+                        sourceId = sourceNames.get(id_field, id_field)
+                        sourceDate = sourceNames.get(report_date_field, report_date_field)
+
+                        # Ids are matched as they are once field mapped
+                        idTypes = {arcpy.ListFields(incidents, sourceId)[0].type}
+                        if sourceId != id_field:
+                            idTypes.add(fieldmap[sourceId]['targetType'])
+
+                        skipRows = latest_csv_rows(incidents,
+                                                   sourceId,
+                                                   sourceDate,
+                                                   bool(idTypes.intersection(["Double", "Single"])),
+                                                   timestamp)
+                        countSkip = len(skipRows)
+                        if countSkip > 0:
+                            messages(m15, log, countSkip, inc_features)
+
+                        if target_feat_type == "service":
+                            serviceIds = inventory.result()
+
+                chunks = csv_chunks(incidents, csvFields, csv_chunk_rows, arcpy.env.scratchFolder, skipRows)
+
+            # Records found in the source table and summary field values
+            total_records = countSkip
+            summaryCounts = Counter()
+
+            for blockNumber, source in enumerate(chunks if chunked else [incidents], 1):
+                incidents = source
+                if chunked:
                     timeNow = dt.strftime(dt.now(), time_format)
-                    messages(m4, log, timeNow, records_to_add)
-
-                    arcpy.SetProgressor("default", "Preparing features to be sent to Target")
-
-                    # Fields that will be copied from geocode results to final fc
-                    copyfieldnames = []
-                    copyfieldnames.extend(matchfieldnames)
-                    copyfieldnames.append("SHAPE@XY")
-
-                    # Fields for error reporting
-                    errorfieldnames = []
-                    errorfieldnames.extend(matchfieldnames)
-                    errorfieldnames.insert(0, errorfield)
-                    errorfieldnames += [long_field, lat_field]
-
-
-
-
-                    if target_feat_type == "service":
-                        
-                        rptNoAppend = join(reports, "{0}_{1}.csv".format(fileNow, noappend_name))
-                        if loc_type == "COORDINATES":
-                            if remove_zeros:
-                                with arcpy.da.UpdateCursor(tempFC, copyfieldnames) as appendRows:
-                                    with open(rptNoAppend, "w") as appendFile:
-
-                                        appendwriter = csv.writer(appendFile)
-                                        appendwriter.writerow(errorfieldnames)
-                                        countAppend = 0
-
-                                        # Index of field with incident ID
-                                        record = errorfieldnames.index(id_field)
-
-                                        errorRecords = []
-
-                                        for appendrow in appendRows:
-                                            lt_index = copyfieldnames.index(lt_field)
-                                            lg_index = copyfieldnames.index(lg_field)
-
-                                            ltVal = appendrow[lt_index]
-                                            lgVal = appendrow[lg_index]
-                                            if ltVal == 0 and lgVal == 0:
-                                                errorrow = list(appendrow)
-                                                errorrow.insert(0, "Coordinates")
-
-                                                # Split the coordinate tuple into X and Y
-                                                lng, lat = list(errorrow[-1])
-                                                errorrow[-1] = lng
-                                                errorrow.append(lat)
-                                                errorrow = tuple(errorrow)
-
-                                                # Write the record out to csv
-                                                appendwriter.writerow(errorrow)
-                                                
-                                                # Add id and field to issue list
-                                                errorRecords.append(retrieveMessage(w4,errorrow[record], "Coordinates"))
-                                                appendRows.deleteRow()
-                                            else:
-                                                countAppend += 1
-                                        
-
-                                # If issues were reported, print them
-                                if len(errorRecords) != 0:
-                                    messages(w1, log, len(errorRecords), rptNoAppend)
-
-                                messages(m18, log, countAppend, inc_features)
-                                        
-                        # Reproject the features
-                        try:
-                            sr_output = fl.properties.extent['spatialReference']['wkid']
-                        except KeyError:
-                            sr_output = fl.properties.extent['spatialReference']['wkt']
-                        proj_out = "{}_proj".format(tempFC)
-                        arcpy.Project_management(tempFC, proj_out, sr_output)                       
-                        #Collect all the date fields that will be updated
-                        dateFields = [field['name'] for field in fl.properties.fields if 'Date' in field['type'] and field['name'] in matchfieldnames]
-                        doubleFields = [field['name'] for field in fl.properties.fields if 'Double' in field['type'] and field['name'] in matchfieldnames]
-
-                        #Convert to Feature Set
-                        fs = arcpy.FeatureSet()
-                        fs.load(proj_out)
-                        
-                        features = json.loads(fs.JSON)["features"]
-
-                        #Remove 'USER_' added from geocoding from field names in each individual feature to be appended to feature service
-                        if loc_type == "ADDRESSES":
-                            for feature in features:
-                                for attribute in list(feature['attributes']): 
-                                        if attribute[:5] == "USER_":
-                                            if attribute.replace("USER_", "") in matchfieldnames:
-                                                feature['attributes'][attribute.replace("USER_", "")] = feature['attributes'].pop(attribute)
-                                        else:
-                                            del feature['attributes'][attribute]
-
-
-
-                        #Remove non matching fields from features to reduce payload being sent in 'edit_features' (adding new features) call
-                        for feature in features:                
-                            for attribute in list(feature['attributes']):
-                                if attribute not in matchfieldnames:
-                                    del feature['attributes'][attribute]
-                                    
-
-                        #Create ArcGIS Python API Features List
-                        fset = []
-                        for feature in features:
-                            tempFeature = Feature(feature['geometry'], feature['attributes'])
-                            fset.append(tempFeature)
-
-                        #Convert all date values to UTC for records to add
-                        for feature in fset:
-                            for dateField in dateFields:
-                                if feature.get_value(dateField):
-                                    if isinstance(feature.get_value(dateField), int):
-                                        fcTime = int(feature.get_value(dateField)/1000)
-                                        try:
-                                            dateValue = dt.utcfromtimestamp(fcTime)
-                                        except (OSError, OverflowError):
-                                            dateValue = dt(1970,1,1,0) + td(seconds=fcTime)
-                                    else:
-                                        dateValue = dt.strptime(feature.get_value(dateField), timestamp)
-                                    try:
-                                        dateValue = int(dateValue.timestamp()*1000)
-                                    except (OSError, OverflowError):
-                                        dateValue = int(((dt(1970,1,1,0) - dateValue).total_seconds() - time.altzone) * -1000)
-                                    feature.set_value(dateField, dateValue)
-                            #Format Doubles or Floats Correctly
-                            if len(doubleFields) > 0:
-                                for doubleField in doubleFields:
-                                    if feature.get_value(doubleField):
-                                        value = feature.get_value(doubleField)
-                                        try:
-                                            if feature.get_value(doubleField).is_integer():
-                                                value = int(feature.get_value(doubleField))
-                                        except AttributeError:
-                                            value = float(str(feature.get_value(doubleField)).replace(',',''))
-                                        feature.set_value(doubleField, value)
-                        
-                        arcpy.ResetProgressor()
-                        arcpy.SetProgressor("default", "Appending features to target features" )
-
-                        #Send new features to service in batches of 100
-                        editFeatures(fset, fl, "add", log)
-                    else:
-                        # Reproject the features
-                        sr_input = arcpy.Describe(tempFC).spatialReference
-                        sr_output = arcpy.Describe(inc_features).spatialReference
-
-                        if sr_input.exportToString() != sr_output.exportToString():
-                            proj_out = "{}_proj".format(tempFC)
-
-                            try:
-                                arcpy.Project_management(tempFC,
-                                                        proj_out,
-                                                        sr_output)
-                                tempFC = proj_out
-                            except arcpy.ExecuteError:
-                                timeNow = dt.strftime(dt.now(), time_format)
-                                messages(w8, log, timeNow)
-
-                        # Append geocode results to fc
-                        rptNoAppend = join(reports, "{0}_{1}.csv".format(fileNow, noappend_name))
-
-                        if loc_type == "ADDRESSES":
-                            geocodefieldnames = ["USER_" + fieldname for fieldname in copyfieldnames[:-1]]
-                            geocodefieldnames.append("SHAPE@XY")
-                            searchnames = geocodefieldnames
-                        else:
-                            searchnames = copyfieldnames
-
-                        desc = arcpy.Describe(inc_features)
-                        if desc.isVersioned:
-                            editor = arcpy.da.Editor(desc.path)
-                            editor.startEditing()
-                            editor.startOperation()                                            
-
-                        with arcpy.da.SearchCursor(tempFC, searchnames) as csvrows:
-                            with arcpy.da.InsertCursor(inc_features, copyfieldnames) as incrows:
-                                # Open csv for un-appended records
-                                with open(rptNoAppend, "w") as appendFile:
-
-                                    appendwriter = csv.writer(appendFile)
-                                    appendwriter.writerow(errorfieldnames)
-
-                                    # Index of field with incident ID
-                                    record = errorfieldnames.index(id_field)
-
-                                    # Initiate count of successfully appended records
-                                    countAppend = 0
-
-                                    # List of ids of records not successfully appended
-                                    errorRecords = []
-
-                                    for csvrow in csvrows:
-                                        try:
-                                            if loc_type == "COORDINATES":
-                                                if remove_zeros:
-                                                    lt_index = copyfieldnames.index(lt_field)
-                                                    lg_index = copyfieldnames.index(lg_field)
-
-                                                    ltVal = csvrow[lt_index]
-                                                    lgVal = csvrow[lg_index]
-
-                                                    if ltVal == 0 and lgVal == 0:
-                                                        raise Exception("invalid_coordinates")
-
-                                            # If the row can be appended
-                                            incrows.insertRow(csvrow)
-                                            countAppend += 1
-
-                                        except Exception as reason:
-                                            # e.g. 'The value type is incompatible with the
-                                            #       field type. [INCIDENTDAT]'
-                                            # Alternatively, the exception
-                                            #      'invalid_coordinates' raised by the
-                                            #       remove_zeros test above
-
-                                            # Get the name of the problem field
-                                            if remove_zeros:
-                                                badfield = "Coordinates"
-                                            else:
-                                                badfield = reason[0].split(" ")[-1]
-                                                badfield = badfield.strip(" []")
-
-                                            # Append field name to start of record
-                                            csvrow = list(csvrow)
-                                            csvrow.insert(0, badfield)
-
-                                            # Split the coordinate tuple into X and Y
-                                            lng, lat = list(csvrow[-1])
-                                            csvrow[-1] = lng
-                                            csvrow.append(lat)
-                                            csvrow = tuple(csvrow)
-
-                                            # Write the record out to csv
-                                            appendwriter.writerow(csvrow)
-
-                                            # Add id and field to issue list
-                                            errorRecords.append(retrieveMessage(w4,csvrow[record], badfield))
-
-                        # If issues were reported, print them
-                        if len(errorRecords) != 0:
-                            messages(w1, log, len(errorRecords), rptNoAppend)
-
-                        messages(m18, log, countAppend, inc_features)
-
-                        del incrows, csvrows
-
-                        if desc.isVersioned:
-                            editor.stopOperation()
-                            editor.stopEditing(True)
-                            del editor
+                    messages(m32, log, timeNow, blockNumber)
+
+                # Workspace of the intermediate datasets
+                staging, stagedBytes = staging_workspace(incidents, tempgdb)
+                messages(m29, log, staging, stagedBytes)
+
+                total_records += import_table(incidents,
+                                              staging,
+                                              cfg,
+                                              inc_features,
+                                              id_field,
+                                              report_date_field,
+                                              summary_field,
+                                              delete_duplicates,
+                                              fieldmap_option,
+                                              fieldmap,
+                                              timestamp,
+                                              loc_type,
+                                              target_feat_type,
+                                              fl,
+                                              serviceIds,
+                                              reports,
+                                              fileNow,
+                                              rptNoAppend,
+                                              summaryCounts,
+                                              log,
+                                              None if chunked else orig_incidents)
+
+            if chunked:
+                write_summary(log, total_records, summaryCounts, orig_incidents, summary_field)
 
         except arcpy.ExecuteError:
             print("{}\n{}\n".format(gp_error, arcpy.GetMessages(2)))
@@ -1451,10 +2437,22 @@ def main(config_file, *args):
 
         finally:
              #Clean up
-            try:
-                arcpy.Delete_management(tempgdb)
-            except arcpy.ExecuteError:
-                pass
+            for workspace in {tempgdb, staging}:
+                try:
+                    arcpy.Delete_management(workspace)
+                except arcpy.ExecuteError:
+                    pass
+
+            if chunks is not None:
+                chunks.close()
+
+            hits, misses = timestamp_cache_info()
+            if hits or misses:
+                messages(m25, log, hits, misses)
+
+            peak = peak_memory()
+            if peak is not None:
+                messages(m30, log, peak)
 
             timeNow = dt.strftime(dt.now(), time_format)
             messages(m8, log, timeNow, orig_incidents)
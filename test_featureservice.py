@@ -0,0 +1,215 @@
+"""----------------------------------------------------------------------------
+  Name:        test_featureservice.py
+  Purpose:     Tests of the paging, batching, retry and bisection logic of
+                 featureservice.py against a local stand-in layer.
+
+  Author:      ArcGIS for Local Government
+
+  Created:     10/16/2026
+----------------------------------------------------------------------------"""
+
+import threading
+import unittest
+
+import featureservice
+from featureservice import edit_batches, fetch_id_inventory, id_where_clauses, query_by_ids, \
+                           send_units, upload_edits
+
+
+class FakeFeature(object):
+    def __init__(self, attributes):
+        self.attributes = attributes
+
+    def get_value(self, field):
+        return self.attributes.get(field)
+
+
+class FakeFeatureSet(object):
+    def __init__(self, features):
+        self.features = features
+
+
+class FakeLayer(object):
+    """Stand-in feature layer holding features in a list.
+        errors holds the responses returned by the next applyEdits requests,
+        and edits whose attributes hold a BAD value are rejected."""
+
+    def __init__(self, ids=(), id_field="INC_ID", max_records=3):
+        self.id_field = id_field
+        self.features = [FakeFeature({'OBJECTID': oid, id_field: idVal})
+                         for oid, idVal in enumerate(ids, 1)]
+        self.properties = {'objectIdField': "OBJECTID", 'maxRecordCount': max_records}
+        self.errors = []
+        self.requests = []
+        self.threads = set()
+        self._lock = threading.Lock()
+
+    def query(self, where="1=1", return_ids_only=False, return_count_only=False, **kwargs):
+        with self._lock:
+            self.threads.add(threading.current_thread().name)
+        if return_ids_only:
+            return {'objectIds': [f.get_value('OBJECTID') for f in self.features]}
+        if return_count_only:
+            return len(self.features)
+        if where.startswith("OBJECTID >="):
+            low, high = [int(part.split()[-1]) for part in where.split(" AND ")]
+            return FakeFeatureSet([f for f in self.features if low <= f.get_value('OBJECTID') <= high])
+        if " IN (" in where:
+            wanted = where.split(" IN (")[1].rstrip(")").split(",")
+            return FakeFeatureSet([f for f in self.features if str(f.get_value(self.id_field)) in wanted])
+        return FakeFeatureSet(list(self.features))
+
+    def edit_features(self, adds=None, updates=None, deletes=None, rollback_on_failure=False):
+        with self._lock:
+            self.requests.append((adds, updates, deletes))
+            if self.errors:
+                error = self.errors.pop(0)
+                if isinstance(error, Exception):
+                    raise error
+                return error
+
+        results = [{'success': 'BAD' not in str(edit)} for edit in adds or []]
+        if rollback_on_failure and not all(result['success'] for result in results):
+            results = [{'success': False} for result in results]
+        return {'addResults': results, 'updateResults': [], 'deleteResults': []}
+
+
+# Exceptions shaped like those of requests, which do not derive from the
+#   builtin TimeoutError and ConnectionError
+class RequestException(IOError):
+    pass
+
+
+class Timeout(RequestException):
+    pass
+
+
+class ReadTimeout(Timeout):
+    pass
+
+
+def arcgis_error(code):
+    """Builds an exception like those raised by arcgis for an error response"""
+    return Exception("Unable to complete operation.\n(Error Code: {})".format(code))
+
+
+def adds(*values):
+    """Builds add edit units"""
+    return [([{'attributes': {'V': value}}], [], []) for value in values]
+
+
+class InventoryTests(unittest.TestCase):
+
+    def test_fetch_id_inventory_reads_every_page(self):
+        fl = FakeLayer(ids=[1.0, 2, "3", 4, 5, 6, 7])
+        self.assertEqual(fetch_id_inventory(fl, "INC_ID", max_workers=2),
+                         {"1", "2", "3", "4", "5", "6", "7"})
+
+    def test_query_by_ids_splits_where_clauses(self):
+        fl = FakeLayer(ids=range(1, 21))
+        features = query_by_ids(fl, "INC_ID", range(5, 15), True, "*", max_bytes=20)
+        self.assertEqual(sorted(f.get_value("INC_ID") for f in features), list(range(5, 15)))
+
+
+class WhereClauseTests(unittest.TestCase):
+
+    def test_non_numeric_ids_are_skipped(self):
+        clauses = list(id_where_clauses("ID", [1, 2, 3.0, float("nan"), "inf", "1e400", "x"], True, 4000))
+        self.assertEqual(clauses, ["ID IN (1,2,3)"])
+
+
+class BatchTests(unittest.TestCase):
+
+    def test_edit_batches_respects_edit_count(self):
+        batches = list(edit_batches(adds(*range(7)), 3, 10 ** 6))
+        self.assertEqual([len(batch) for batch in batches], [3, 3, 1])
+
+    def test_edit_batches_respects_payload_size(self):
+        batches = list(edit_batches(adds("x" * 50, "y" * 50, "z"), 100, 160))
+        self.assertEqual([len(batch) for batch in batches], [2, 1])
+
+
+class RetryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.sleep = featureservice.sleep
+        featureservice.sleep = lambda seconds: None
+
+    def tearDown(self):
+        featureservice.sleep = self.sleep
+
+    def test_throttled_request_is_retried(self):
+        fl = FakeLayer()
+        fl.errors = [{'error': {'code': 429, 'message': "Too many requests"}}]
+        pairs = send_units(fl, adds(1, 2), retries=2)
+        self.assertEqual(len(fl.requests), 2)
+        self.assertFalse(featureservice.batch_error(pairs[0][1]))
+
+    def test_permanent_error_is_not_retried(self):
+        fl = FakeLayer()
+        fl.errors = [{'error': {'code': 400, 'message': "Invalid value 15003 for field PRIORITY"}}]
+        send_units(fl, adds(1), retries=2)
+        self.assertEqual(len(fl.requests), 1)
+
+    def test_timed_out_adds_are_not_sent_again(self):
+        fl = FakeLayer()
+        fl.errors = [ReadTimeout("Read timed out. (read timeout=30)")]
+        results = upload_edits(fl, adds(1, 2, 3, 4), max_workers=1, max_edits=4)
+        self.assertEqual(len(fl.requests), 1)
+        self.assertEqual(len(results.failures), 4)
+
+    def test_timed_out_updates_are_retried(self):
+        fl = FakeLayer()
+        fl.errors = [ReadTimeout("Read timed out. (read timeout=30)")]
+        send_units(fl, [([], [{'attributes': {'V': 1}}], [])], retries=2)
+        self.assertEqual(len(fl.requests), 2)
+
+    def test_arcgis_error_code_is_retried(self):
+        fl = FakeLayer()
+        fl.errors = [arcgis_error(503)]
+        pairs = send_units(fl, adds(1, 2), retries=2)
+        self.assertEqual(len(fl.requests), 2)
+        self.assertFalse(featureservice.batch_error(pairs[0][1]))
+
+    def test_outage_does_not_split_batches(self):
+        fl = FakeLayer()
+        fl.errors = [arcgis_error(503)] * 10
+        units = [([], [{'attributes': {'V': i}}], []) for i in range(16)]
+        results = upload_edits(fl, units, max_workers=1, max_edits=16, retries=2)
+        self.assertEqual(len(fl.requests), 3)
+        self.assertEqual(len(results.failures), 16)
+
+    def test_rejected_batch_is_split(self):
+        fl = FakeLayer()
+        fl.errors = [arcgis_error(400)]
+        results = upload_edits(fl, adds(1, 2), max_workers=1, max_edits=2)
+        self.assertEqual(len(fl.requests), 3)
+        self.assertEqual(results.succeeded, 2)
+
+    def test_rejected_batch_is_split_to_isolate_failures(self):
+        fl = FakeLayer()
+        results = upload_edits(fl, adds(1, "BAD", 3, 4), max_workers=1, max_edits=4, rollback=True)
+        self.assertEqual(results.succeeded, 3)
+        self.assertEqual([edit['attributes']['V'] for mode, edit, description in results.failures], ["BAD"])
+
+    def test_every_edit_is_checked(self):
+        fl = FakeLayer()
+        results = upload_edits(fl, adds(*range(10)), max_workers=3, max_edits=3)
+        self.assertEqual((results.succeeded, len(results.failures), results.requests), (10, 0, 4))
+
+    def test_units_are_read_on_calling_thread(self):
+        fl = FakeLayer()
+        readers = set()
+
+        def units():
+            for unit in adds(*range(5)):
+                readers.add(threading.current_thread())
+                yield unit
+
+        results = upload_edits(fl, units(), max_workers=2, max_edits=2)
+        self.assertEqual(readers, {threading.current_thread()})
+        self.assertEqual(results.succeeded, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
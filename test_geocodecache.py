@@ -0,0 +1,81 @@
+"""----------------------------------------------------------------------------
+  Name:        test_geocodecache.py
+  Purpose:     Tests of the expiry, eviction, locator namespaces and spatial
+                 reference handling of geocodecache.py.
+
+  Author:      ArcGIS for Local Government
+
+  Created:     10/16/2026
+----------------------------------------------------------------------------"""
+
+from os.path import join
+import shutil
+import tempfile
+import unittest
+
+import geocodecache
+from geocodecache import GeocodeCache, address_key
+
+
+def result(x):
+    """Builds a matched result at x"""
+    return (x, 1.0, 'M', 'PointAddress', 100.0, "{} MAIN ST".format(x))
+
+
+class GeocodeCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = join(self.folder, "cache.sqlite")
+        self.now = 1000000.0
+        self.time = geocodecache.time
+        geocodecache.time = lambda: self.now
+
+    def tearDown(self):
+        geocodecache.time = self.time
+        shutil.rmtree(self.folder)
+
+    def test_address_key_normalizes_inputs(self):
+        self.assertEqual(address_key([" 1  Main st ", 12.0, None]), "1 MAIN ST|12|")
+
+    def test_results_are_returned(self):
+        with GeocodeCache(self.path, "loc") as cache:
+            cache.put_many([("A", result(1)), ("B", result(2))])
+            self.assertEqual(cache.get_many(["A", "C"]), {"A": result(1)})
+
+    def test_expired_results_are_not_returned(self):
+        with GeocodeCache(self.path, "loc", ttl_days=1) as cache:
+            cache.put_many([("A", result(1))])
+            self.now += 86401
+            self.assertEqual(cache.get_many(["A"]), {})
+
+    def test_oldest_results_are_evicted(self):
+        with GeocodeCache(self.path, "loc", max_entries=2) as cache:
+            for n, key in enumerate("ABC"):
+                self.now += 1
+                cache.put_many([(key, result(n))])
+        with GeocodeCache(self.path, "loc", max_entries=2) as cache:
+            self.assertEqual(sorted(cache.get_many("ABC")), ["B", "C"])
+
+    def test_locators_do_not_share_results(self):
+        with GeocodeCache(self.path, "first") as first, GeocodeCache(self.path, "second") as second:
+            first.put_many([("A", result(1))])
+            second.put_many([("A", result(2))])
+            self.assertEqual(first.get_many(["A"]), {"A": result(1)})
+            self.assertEqual(second.get_many(["A"]), {"A": result(2)})
+
+    def test_new_spatial_reference_discards_results(self):
+        with GeocodeCache(self.path, "loc") as cache, GeocodeCache(self.path, "other") as other:
+            cache.set_spatial_reference("4326")
+            cache.put_many([("A", result(1))])
+            other.put_many([("A", result(2))])
+            cache.set_spatial_reference("4326")
+            self.assertEqual(cache.get_many(["A"]), {"A": result(1)})
+            cache.set_spatial_reference("3857")
+            self.assertEqual(cache.get_spatial_reference(), "3857")
+            self.assertEqual(cache.get_many(["A"]), {})
+            self.assertEqual(other.get_many(["A"]), {"A": result(2)})
+
+
+if __name__ == '__main__':
+    unittest.main()